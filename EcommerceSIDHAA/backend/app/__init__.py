@@ -1,33 +1,92 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_bcrypt import Bcrypt
-import os
-
-app = Flask(__name__, instance_path='/app/EcommerceSIDHAA/backend/instance')
-app.config['SECRET_KEY'] = 'your_secret_key'  # Change this in production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
-
-from app import routes, models
-import logging
-from logging.handlers import RotatingFileHandler
-import os
-
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-file_handler = RotatingFileHandler('logs/ecommerce.log', maxBytes=10240, backupCount=10)
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
-
-app.logger.setLevel(logging.INFO)
-app.logger.info('E-commerce startup')
-
-with app.app_context():
-    db.create_all()
+import threading
+
+from app.cache import ProductCache
+from app.images import ImageStore
+from app.passwords import PasswordHasher
+
+hasher = PasswordHasher()
+image_store = ImageStore()
+product_cache = ProductCache()
+
+_lock = threading.Lock()
+
+
+def _make_db():
+    from flask_sqlalchemy import SQLAlchemy
+    return SQLAlchemy()
+
+
+def _make_migrate():
+    from flask_migrate import Migrate
+    return Migrate()
+
+
+# SQLAlchemy and Alembic take most of the startup time, so db and migrate
+# are only built when first used. Importing the package (for its config,
+# caches or from a CLI command) has no side effects and loads neither.
+_LAZY = {'db': _make_db, 'migrate': _make_migrate}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _lock:
+        if name not in globals():
+            globals()[name] = _LAZY[name]()
+    return globals()[name]
+
+
+def create_app(config=None):
+    """Build the application.
+
+    config overrides the environment-driven settings in Config. The schema
+    is not created here; run `flask db upgrade` once per deployment.
+    """
+    import click
+    from flask import Flask
+
+    from app.config import Config, configure_sqlite, engine_options
+    from app.log import configure_logging
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    proxies = app.config['TRUSTED_PROXIES']
+    if proxies:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+
+        # remote_addr becomes the client address the proxies forwarded
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    db = __getattr__('db')
+    db.init_app(app)
+    # Migrations only ever run through `flask db`; serving processes skip
+    # loading Alembic altogether
+    if click.get_current_context(silent=True) is not None:
+        __getattr__('migrate').init_app(app, db)
+    hasher.configure(rounds=app.config['BCRYPT_LOG_ROUNDS'], workers=app.config['PASSWORD_HASH_WORKERS'])
+    image_store.configure(root=app.config['IMAGE_DIR'], workers=app.config['IMAGE_WORKERS'],
+                          max_bytes=app.config['IMAGE_MAX_BYTES'], max_pixels=app.config['IMAGE_MAX_PIXELS'])
+    product_cache.init_app(app)
+
+    with app.app_context():
+        configure_sqlite(db.engine, app.config)
+
+    # Registered first, so every response, including those of hooks that
+    # cut a request short such as the rate limiter's 429, gets a request
+    # ID and an access log line
+    app.extensions['log_writer'] = configure_logging(app)
+
+    from app import analytics, auth, carts, catalog, metrics, ratelimit, routes
+    analytics.init_app(app)
+    auth.init_app(app)
+    carts.init_app(app)
+    catalog.init_app(app)
+    metrics.init_app(app)
+    # After metrics, so rejected requests are still measured
+    ratelimit.init_app(app)
+    app.register_blueprint(routes.bp)
+
+    app.logger.info('E-commerce startup')
+    return app
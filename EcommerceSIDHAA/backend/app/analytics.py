@@ -0,0 +1,138 @@
+import json
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+
+from app import db
+from app.models import DailySales, Order, OrderItem, Product, ProductSales, conflict_insert
+from app.money import from_cents
+
+SORT_COLUMNS = {'revenue': ProductSales.revenue_cents, 'units': ProductSales.units}
+
+
+def _daily_rows(condition):
+    """SELECT of (day, orders, units, revenue_cents) for the orders matching condition."""
+    return (select(func.date(Order.created_at).label('day'),
+                   func.count(func.distinct(Order.id)).label('orders'),
+                   func.sum(OrderItem.quantity).label('units'),
+                   func.sum(OrderItem.quantity * OrderItem.price_cents).label('revenue_cents'))
+            .join(OrderItem, OrderItem.order_id == Order.id)
+            .where(condition)
+            .group_by(func.date(Order.created_at)))
+
+
+def _product_rows(condition):
+    """SELECT of (product_id, orders, units, revenue_cents) for the orders matching condition."""
+    return (select(OrderItem.product_id,
+                   func.count(func.distinct(Order.id)).label('orders'),
+                   func.sum(OrderItem.quantity).label('units'),
+                   func.sum(OrderItem.quantity * OrderItem.price_cents).label('revenue_cents'))
+            .join(OrderItem, OrderItem.order_id == Order.id)
+            .where(condition)
+            .group_by(OrderItem.product_id))
+
+
+def _accumulate(model, key, rows):
+    """Add the counters in rows to the summary table, inserting missing keys."""
+    table = model.__table__
+    stmt = conflict_insert(table).from_select(list(rows.selected_columns.keys()), rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={column: table.c[column] + stmt.excluded[column]
+              for column in ('orders', 'units', 'revenue_cents')},
+    ))
+
+
+def record_order(order_id):
+    """Fold one order into the summaries within the caller's transaction.
+
+    Call it last before commit: on PostgreSQL the day's row stays locked
+    until then, which serializes concurrent checkouts for that moment.
+    """
+    condition = Order.id == order_id
+    _accumulate(ProductSales, 'product_id', _product_rows(condition))
+    _accumulate(DailySales, 'day', _daily_rows(condition))
+
+
+def rebuild(batch_size=1000, progress=None):
+    """Recompute the summaries from order history, batch_size orders per commit.
+
+    Orders placed while this runs are recorded by checkout as usual: the
+    tables are emptied in the same transaction that fixes the last order
+    ID to backfill, and later orders are left to record_order. progress is
+    called with the number of orders backfilled after every batch.
+    """
+    db.session.execute(delete(DailySales))
+    db.session.execute(delete(ProductSales))
+    last_id = db.session.query(func.max(Order.id)).scalar() or 0
+    db.session.commit()
+
+    done = 0
+    after = 0
+    while after < last_id:
+        ids = db.session.execute(select(Order.id).where(Order.id > after, Order.id <= last_id)
+                                 .order_by(Order.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        condition = Order.id.between(ids[0], ids[-1])
+        _accumulate(ProductSales, 'product_id', _product_rows(condition))
+        _accumulate(DailySales, 'day', _daily_rows(condition))
+        db.session.commit()
+        after = ids[-1]
+        done += len(ids)
+        if progress:
+            progress(done)
+    return done
+
+
+def _day_filter(query, start, end):
+    if start is not None:
+        query = query.filter(DailySales.day >= start)
+    if end is not None:
+        query = query.filter(DailySales.day <= end)
+    return query
+
+
+def sales_by_day(start=None, end=None):
+    """Return [{'day', 'orders', 'units', 'revenue'}] for days in [start, end]."""
+    rows = _day_filter(DailySales.query, start, end).order_by(DailySales.day)
+    return [{'day': row.day.isoformat(), 'orders': row.orders, 'units': row.units,
+             'revenue': from_cents(row.revenue_cents)} for row in rows]
+
+
+def sales_totals(start=None, end=None):
+    """Return order count, units, revenue and average order value over [start, end]."""
+    query = db.session.query(func.coalesce(func.sum(DailySales.orders), 0),
+                             func.coalesce(func.sum(DailySales.units), 0),
+                             func.coalesce(func.sum(DailySales.revenue_cents), 0))
+    orders, units, revenue_cents = _day_filter(query, start, end).one()
+    return {
+        'orders': orders,
+        'units': units,
+        'revenue': from_cents(revenue_cents),
+        'average_order_value': from_cents(round(revenue_cents / orders)) if orders else 0,
+    }
+
+
+def top_products(sort='revenue', limit=10):
+    """Return the best selling products by revenue or units, best first."""
+    column = SORT_COLUMNS[sort]
+    rows = (db.session.query(ProductSales, Product.name)
+            .outerjoin(Product, Product.id == ProductSales.product_id)
+            .order_by(column.desc(), ProductSales.product_id).limit(limit))
+    return [{'product_id': sales.product_id, 'name': name, 'orders': sales.orders,
+             'units': sales.units, 'revenue': from_cents(sales.revenue_cents)} for sales, name in rows]
+
+
+@click.command('rebuild-sales-summary')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def rebuild_sales_command(batch_size):
+    """Recompute the sales summary tables from order history."""
+    orders = rebuild(batch_size, lambda done: click.echo(f'{done} orders backfilled', err=True))
+    click.echo(json.dumps({'orders': orders}))
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_sales_command)
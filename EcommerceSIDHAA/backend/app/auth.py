@@ -0,0 +1,94 @@
+import hashlib
+from functools import lru_cache, wraps
+
+from flask import current_app, g, jsonify, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app.cache import LRUCache
+from app.models import User
+
+# Identity rows for handlers that need more than the user ID. Usernames and
+# emails never change after registration, so a short TTL is only a bound on
+# memory held for inactive users.
+user_cache = LRUCache()
+
+
+def init_app(app):
+    user_cache.max_size = app.config['USER_CACHE_SIZE']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+
+
+@lru_cache(maxsize=4)
+def _serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt='auth-token',
+                                  signer_kwargs={'digest_method': hashlib.sha256})
+
+
+def issue_token(user_id):
+    """Return a signed token carrying the user ID."""
+    return _serializer(current_app.config['SECRET_KEY']).dumps({'uid': user_id})
+
+
+def verify_token(token):
+    """Return the user ID in token, or None if it is forged or expired."""
+    try:
+        config = current_app.config
+        data = _serializer(config['SECRET_KEY']).loads(token, max_age=config['AUTH_TOKEN_TTL'])
+    except BadSignature:
+        return None
+    return data.get('uid') if isinstance(data, dict) else None
+
+
+def authenticate(token):
+    """verify_token, remembered for the rest of the request.
+
+    The rate limiter identifies clients by their token before the view's
+    token_required runs, and this keeps that to one signature check.
+    """
+    verified = g.get('verified_token')
+    if verified is not None and verified[0] == token:
+        return verified[1]
+    user_id = verify_token(token)
+    g.verified_token = (token, user_id)
+    return user_id
+
+
+def get_user(user_id):
+    """Return {'id', 'username', 'email'} for user_id from the cache or the DB."""
+    user = user_cache.get(user_id)
+    if user is None:
+        row = User.query.get(user_id)
+        if not row:
+            return None
+        user = {'id': row.id, 'username': row.username, 'email': row.email}
+        user_cache.set(user_id, user)
+    return user
+
+
+def token_required(load_user=False):
+    """Authenticate the request from its 'Authorization: Bearer' token.
+
+    The token alone proves identity, so g.user_id is set without touching
+    the database. Pass load_user=True to also get the cached user row in
+    g.user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get('Authorization', '')
+            scheme, _, token = header.partition(' ')
+            if scheme.lower() != 'bearer' or not token:
+                return jsonify({'message': 'Token is missing!'}), 401
+
+            user_id = authenticate(token.strip())
+            if user_id is None:
+                return jsonify({'message': 'Token is invalid or expired!'}), 401
+            g.user_id = user_id
+
+            if load_user:
+                g.user = get_user(user_id)
+                if not g.user:
+                    return jsonify({'message': 'User not found!'}), 404
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
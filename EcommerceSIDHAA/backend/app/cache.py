@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process cache bounded by entry count, with per-entry TTL."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        # Counters live outside the LRU so they can never be evicted
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'max_size': self.max_size,
+        }
+
+
+class RedisCache:
+    """Cache backed by any Redis-compatible client, shared across workers.
+
+    Size limits and evictions are left to the server's maxmemory policy.
+    """
+
+    def __init__(self, client, ttl=300, prefix='ecommerce:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + key))
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'size': None,
+            'max_size': None,
+        }
+
+
+class ProductCache:
+    """Read-through cache of serialized product responses."""
+
+    LISTING_GENERATION = 'products:generation'
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def init_app(self, app):
+        self.backend = create_product_cache_backend(app.config)
+
+    def product_key(self, product_id):
+        # Keyed by a per-product generation, like listings: a reader that
+        # built the entry from a row an update has since replaced stores it
+        # under a key that is no longer read, instead of over the fresh one
+        generation = self.backend.counter(f'product:{product_id}:generation')
+        return f'product:{product_id}:{generation}'
+
+    def listing_key(self, args):
+        # Listings are keyed by a generation counter so that any catalog
+        # write retires every cached page at once
+        generation = self.backend.counter(self.LISTING_GENERATION)
+        query = '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+        return f'products:{generation}:{query}'
+
+    def get_or_build(self, key, build):
+        """Return the cached (etag, body) pair for key, building it on a miss.
+
+        Both parts are stored together as one value, the ETag on the first
+        line, so they can never disagree.
+        """
+        value = self.backend.get(key)
+        if value is None:
+            etag, body = build()
+            self.backend.set(key, etag.encode('ascii') + b'\n' + body)
+            return etag, body
+        etag, body = value.split(b'\n', 1)
+        return etag.decode('ascii'), body
+
+    def invalidate_product(self, product_id):
+        generation = self.backend.incr(f'product:{product_id}:generation')
+        self.backend.delete(f'product:{product_id}:{generation - 1}')
+        self.invalidate_listings()
+
+    def invalidate_listings(self):
+        self.backend.incr(self.LISTING_GENERATION)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def create_product_cache_backend(config):
+    """Build the product cache storage named by PRODUCT_CACHE_BACKEND."""
+    if config.get('PRODUCT_CACHE_BACKEND') == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('PRODUCT_CACHE_BACKEND=redis requires the redis package')
+        client = redis.Redis.from_url(config['PRODUCT_CACHE_REDIS_URL'])
+        return RedisCache(client, ttl=config['PRODUCT_CACHE_TTL'])
+    return LRUCache(max_size=config['PRODUCT_CACHE_SIZE'], ttl=config['PRODUCT_CACHE_TTL'])
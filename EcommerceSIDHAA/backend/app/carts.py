@@ -0,0 +1,420 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import delete
+from werkzeug.local import LocalProxy
+
+from app import db
+from app.models import Cart, CartItem, conflict_insert
+
+
+class CartNotFound(Exception):
+    pass
+
+
+class ItemNotInCart(Exception):
+    pass
+
+
+def _cart_id(user_id):
+    """Return the ID of the user's cart, creating it if needed, in one statement."""
+    stmt = conflict_insert(Cart.__table__).values(user_id=user_id)
+    # A no-op update rather than DO NOTHING, so RETURNING yields the existing row
+    stmt = stmt.on_conflict_do_update(index_elements=['user_id'], set_={'user_id': stmt.excluded.user_id})
+    return db.session.execute(stmt.returning(Cart.__table__.c.id)).scalar_one()
+
+
+class SQLCartStore:
+    """Carts kept directly in the cart and cart_item tables."""
+
+    def items(self, user_id):
+        """Return [(item id, product id, quantity)] in insertion order."""
+        return db.session.query(CartItem.id, CartItem.product_id, CartItem.quantity).join(
+            Cart).filter(Cart.user_id == user_id).order_by(CartItem.id).all()
+
+    def _cart(self, user_id):
+        cart = Cart.query.filter_by(user_id=user_id).first()
+        if not cart:
+            raise CartNotFound()
+        return cart
+
+    def _item(self, user_id, product_id):
+        cart_item = CartItem.query.filter_by(cart_id=self._cart(user_id).id, product_id=product_id).first()
+        if not cart_item:
+            raise ItemNotInCart()
+        return cart_item
+
+    def add(self, user_id, product_id, quantity):
+        # Upserts against the unique cart and cart item indexes: no
+        # read-modify-write, so concurrent adds neither lose quantity nor
+        # create duplicate rows
+        stmt = conflict_insert(CartItem.__table__).values(cart_id=_cart_id(user_id), product_id=product_id,
+                                                          quantity=quantity)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['cart_id', 'product_id'],
+            set_={'quantity': CartItem.__table__.c.quantity + stmt.excluded.quantity},
+        ))
+        db.session.commit()
+
+    def update(self, user_id, product_id, quantity):
+        cart_item = self._item(user_id, product_id)
+        if quantity <= 0:
+            db.session.delete(cart_item)
+        else:
+            cart_item.quantity = quantity
+        db.session.commit()
+
+    def remove(self, user_id, product_id):
+        db.session.delete(self._item(user_id, product_id))
+        db.session.commit()
+
+    def apply(self, user_id, operations):
+        """Apply [(op, product_id, quantity)] in one transaction."""
+        cart_id = _cart_id(user_id)
+        items = {item.product_id: item for item in CartItem.query.filter_by(cart_id=cart_id)}
+
+        # Work out the final quantities first, so a product removed and
+        # added again in one batch keeps its row instead of colliding with
+        # it on the unique (cart_id, product_id) index
+        quantities = {product_id: item.quantity for product_id, item in items.items()}
+        for op, product_id, quantity in operations:
+            if op == 'add':
+                quantity += quantities.get(product_id, 0)
+            if op == 'remove' or quantity <= 0:
+                quantities.pop(product_id, None)
+            else:
+                quantities[product_id] = quantity
+
+        for product_id, item in items.items():
+            if product_id in quantities:
+                item.quantity = quantities.pop(product_id)
+            else:
+                db.session.delete(item)
+        db.session.add_all(CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                           for product_id, quantity in quantities.items())
+        db.session.commit()
+
+    def materialize(self, user_id):
+        """Make sure the SQL rows reflect the cart; they always do here."""
+
+    def clear(self, user_id):
+        """Forget the cart after checkout removed its SQL rows."""
+
+
+class LocalKV:
+    """Thread-safe in-process stand-in for the Redis commands used by KVCartStore and rate limiting."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._sets = {}
+        self._counters = {}  # key -> [value, expiry time or None]
+        self._lock = threading.RLock()
+
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        """Like redis-py's: call func(pipe) and execute what it queues after pipe.multi().
+
+        The lock is held throughout, so nothing can change the watched keys
+        and no retry is ever needed.
+        """
+        with self._lock:
+            pipe = _LocalPipeline(self, immediate=True)
+            result = func(pipe)
+            values = pipe.execute()
+        return result if value_from_callable else values
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+    def hexists(self, key, field):
+        with self._lock:
+            return field in self._hashes.get(key, {})
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            fields = self._hashes.setdefault(key, {})
+            if field is not None:
+                fields[field] = value
+            fields.update(mapping or {})
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            fields = self._hashes.setdefault(key, {})
+            fields[field] = int(fields.get(field, 0)) + amount
+            return fields[field]
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            existing = self._hashes.get(key, {})
+            return sum(1 for field in fields if existing.pop(field, None) is not None)
+
+    def _counter(self, key):
+        counter = self._counters.get(key)
+        if counter is not None and counter[1] is not None and counter[1] <= time.time():
+            del self._counters[key]
+            return None
+        return counter
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            counter = self._counter(key) or self._counters.setdefault(key, [0, None])
+            counter[0] += amount
+            return counter[0]
+
+    def expire(self, key, seconds):
+        with self._lock:
+            counter = self._counter(key)
+            if counter is None:
+                return False
+            counter[1] = time.time() + seconds
+            return True
+
+    def get(self, key):
+        with self._lock:
+            counter = self._counter(key)
+            return None if counter is None else str(counter[0]).encode()
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._hashes.pop(key, None)
+                self._sets.pop(key, None)
+                self._counters.pop(key, None)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._sets.setdefault(key, set()).update(members)
+
+    def spop(self, key, count):
+        with self._lock:
+            members = self._sets.get(key, set())
+            return [members.pop() for _ in range(min(count, len(members)))]
+
+
+class _LocalPipeline:
+    """Queues LocalKV commands and runs them under one lock, like MULTI/EXEC.
+
+    An immediate pipeline runs commands as they are called until multi(),
+    like a redis-py pipeline after WATCH.
+    """
+
+    def __init__(self, kv, immediate=False):
+        self._kv = kv
+        self._commands = []
+        self._immediate = immediate
+
+    def watch(self, *keys):
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def __getattr__(self, name):
+        command = getattr(self._kv, name)
+        if self._immediate:
+            return command
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+        return queue
+
+    def execute(self):
+        with self._kv._lock:
+            return [command(*args, **kwargs) for command, args, kwargs in self._commands]
+
+
+class KVCartStore:
+    """Carts kept in a Redis-compatible key-value store, written behind to SQL.
+
+    Each cart is one hash of product ID -> quantity, so mutations are O(1)
+    and issue no SQL. Changed carts are recorded in a dirty set and copied
+    into the cart tables by flush(), which runs periodically in the
+    background and for a single cart at checkout via materialize().
+    """
+
+    LOADED = '__loaded__'
+    DIRTY = 'carts:dirty'
+    FLUSH_BATCH_SIZE = 500
+
+    def __init__(self, kv, flush_interval=0, app=None):
+        self.kv = kv
+        self.flush_interval = flush_interval
+        self.app = app
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id):
+        return f'cart:{user_id}'
+
+    def _load(self, user_id):
+        """Seed the hash from SQL the first time a cart is touched."""
+        key = self._key(user_id)
+        if self.kv.hexists(key, self.LOADED):
+            return key
+        rows = SQLCartStore().items(user_id)
+        mapping = {str(product_id): quantity for _, product_id, quantity in rows}
+        mapping[self.LOADED] = 1
+
+        def seed(pipe):
+            # Another request may have seeded and changed the cart since
+            # the check above; WATCH retries until it is seen, so its
+            # changes are never overwritten with the SQL rows
+            if not pipe.hexists(key, self.LOADED):
+                pipe.multi()
+                pipe.hset(key, mapping=mapping)
+
+        self.kv.transaction(seed, key)
+        return key
+
+    def _decode(self, fields):
+        quantities = {}
+        for field, value in fields.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            if field != self.LOADED:
+                quantities[int(field)] = int(value)
+        return quantities
+
+    def _quantities(self, user_id):
+        return self._decode(self.kv.hgetall(self._load(user_id)))
+
+    def _mark_dirty(self, user_id):
+        self.kv.sadd(self.DIRTY, user_id)
+        if self.flush_interval and self._flusher is None:
+            with self._flusher_lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_forever, daemon=True,
+                                                     name='cart-write-behind')
+                    self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                self.app.logger.exception('Cart write-behind failed')
+
+    def items(self, user_id):
+        # Carts hold no item rows here, so the product ID doubles as item ID
+        return [(product_id, product_id, quantity)
+                for product_id, quantity in sorted(self._quantities(user_id).items())]
+
+    def add(self, user_id, product_id, quantity):
+        self.kv.hincrby(self._load(user_id), str(product_id), quantity)
+        self._mark_dirty(user_id)
+
+    def update(self, user_id, product_id, quantity):
+        key = self._load(user_id)
+        if not self.kv.hexists(key, str(product_id)):
+            raise ItemNotInCart()
+        if quantity <= 0:
+            self.kv.hdel(key, str(product_id))
+        else:
+            self.kv.hset(key, str(product_id), quantity)
+        self._mark_dirty(user_id)
+
+    def remove(self, user_id, product_id):
+        if not self.kv.hdel(self._load(user_id), str(product_id)):
+            raise ItemNotInCart()
+        self._mark_dirty(user_id)
+
+    def apply(self, user_id, operations):
+        """Apply [(op, product_id, quantity)] atomically.
+
+        The cart is read and rewritten in one WATCH/MULTI transaction,
+        which is retried if another request changes the cart in between.
+        """
+        key = self._load(user_id)
+
+        def write(pipe):
+            quantities = self._decode(pipe.hgetall(key))
+            for op, product_id, quantity in operations:
+                if op == 'add':
+                    quantity += quantities.get(product_id, 0)
+                if op == 'remove' or quantity <= 0:
+                    quantities.pop(product_id, None)
+                else:
+                    quantities[product_id] = quantity
+            mapping = {str(product_id): quantity for product_id, quantity in quantities.items()}
+            mapping[self.LOADED] = 1
+            pipe.multi()
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+
+        self.kv.transaction(write, key)
+        self._mark_dirty(user_id)
+
+    def _write(self, user_id):
+        """Replace the SQL rows of one cart with its current contents."""
+        quantities = {p: q for p, q in self._quantities(user_id).items() if q > 0}
+        cart = Cart.query.filter_by(user_id=user_id).first()
+        if cart:
+            db.session.execute(delete(CartItem).where(CartItem.cart_id == cart.id))
+        if not quantities:
+            if cart:
+                db.session.execute(delete(Cart).where(Cart.id == cart.id))
+            return
+        cart_id = cart.id if cart else _cart_id(user_id)
+        db.session.execute(CartItem.__table__.insert(), [
+            {'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity}
+            for product_id, quantity in quantities.items()
+        ])
+
+    def materialize(self, user_id):
+        """Write one cart to SQL inside the caller's transaction."""
+        self._write(user_id)
+
+    def flush(self):
+        """Write every cart changed since the last flush and commit."""
+        while True:
+            user_ids = self.kv.spop(self.DIRTY, self.FLUSH_BATCH_SIZE)
+            if not user_ids:
+                return
+            try:
+                for user_id in user_ids:
+                    self._write(int(user_id))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.kv.sadd(self.DIRTY, *user_ids)
+                raise
+
+    def clear(self, user_id):
+        """Drop the cart after checkout emptied it in SQL."""
+        self.kv.delete(self._key(user_id))
+
+
+def create_cart_store(app):
+    """Build the cart store named by CART_BACKEND: sql, memory or redis.
+
+    memory is only correct in a single process. Every process would hold
+    its own copy of a cart, seeded from SQL that may not have been flushed
+    yet, and flush it back over the others' changes.
+    """
+    config = app.config
+    backend = config['CART_BACKEND']
+    if backend == 'sql':
+        return SQLCartStore()
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CART_BACKEND=redis requires the redis package')
+        kv = redis.Redis.from_url(config['CART_REDIS_URL'])
+    else:
+        kv = LocalKV()
+    return KVCartStore(kv, flush_interval=config['CART_WRITE_BEHIND_INTERVAL'], app=app)
+
+
+def init_app(app):
+    app.extensions['cart_store'] = create_cart_store(app)
+
+
+# The store of the application handling the current request
+cart_store = LocalProxy(lambda: current_app.extensions['cart_store'])
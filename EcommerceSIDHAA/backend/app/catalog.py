@@ -0,0 +1,249 @@
+import csv
+import io
+import json
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from app import db, product_cache
+from app.models import Product, conflict_insert
+from app.money import to_cents
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ('id', 'name', 'description', 'price', 'image_url', 'stock')
+MAX_REPORTED_ERRORS = 100
+# Largest value of a 64-bit signed integer column
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a text stream without reading it all."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+                continue
+            yield line_num, row
+
+
+def _optional(row, key):
+    value = row.get(key)
+    return None if value in (None, '') else value
+
+
+def _text(row, key):
+    value = _optional(row, key)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'{key} must be a string')
+    return value
+
+
+def _integer(row, key):
+    """An integer column from a CSV string or JSON number; fractions raise ValueError."""
+    value = _optional(row, key)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f'Invalid {key}')
+    elif isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'Invalid {key}')
+    if value < 0:
+        raise ValueError(f'{key} must not be negative')
+    if value > MAX_INTEGER:
+        raise ValueError(f'{key} is too large')
+    return value
+
+
+def validate_row(row):
+    """Return the product column values for row, or raise ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('Row is not an object')
+    name = _text(row, 'name')
+    if not name:
+        raise ValueError('Missing name')
+    if len(name) > 120:
+        raise ValueError('Name is longer than 120 characters')
+    try:
+        price_cents = to_cents(row['price'])
+    except (KeyError, ValueError):
+        raise ValueError('Missing or invalid price')
+    if price_cents < 0:
+        raise ValueError('Price must not be negative')
+
+    values = {
+        'name': name,
+        'description': _text(row, 'description') or '',
+        'price_cents': price_cents,
+        'image_url': _text(row, 'image_url') or '',
+        'stock': _integer(row, 'stock'),
+    }
+    if len(values['image_url']) > 255:
+        raise ValueError('Image URL is longer than 255 characters')
+    product_id = _integer(row, 'id')
+    if product_id is not None:
+        values['id'] = product_id
+    return values
+
+
+def _upsert_statement():
+    """INSERT that updates the existing row when the product ID is taken."""
+    stmt = conflict_insert(Product.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={
+            'name': stmt.excluded.name,
+            'description': stmt.excluded.description,
+            'price_cents': stmt.excluded.price_cents,
+            'image_url': stmt.excluded.image_url,
+            'stock': stmt.excluded.stock,
+            'version': Product.__table__.c.version + 1,
+        },
+    )
+
+
+def _write(rows):
+    with_id = [values for values in rows if 'id' in values]
+    without_id = [values for values in rows if 'id' not in values]
+    # Each list goes to the driver as a single executemany
+    if with_id:
+        db.session.execute(_upsert_statement(), with_id)
+    if without_id:
+        db.session.execute(Product.__table__.insert(), without_id)
+    db.session.commit()
+
+
+def _write_batch(batch, report):
+    try:
+        _write([values for _, values in batch])
+        report['imported'] += len(batch)
+        return
+    except Exception:
+        # Not only SQLAlchemyError: drivers raise e.g. OverflowError on
+        # values they cannot bind, and one bad batch must not end the import
+        db.session.rollback()
+
+    # Retry row by row, so only the failing rows are lost, each reported
+    # against its own line
+    for line, values in batch:
+        try:
+            _write([values])
+        except Exception as e:
+            db.session.rollback()
+            _add_error(report, line, f'Row failed: {e.__class__.__name__}')
+        else:
+            report['imported'] += 1
+
+
+def _add_error(report, line, message):
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line, 'error': message})
+
+
+def import_products(stream, fmt, batch_size=1000, progress=None):
+    """Validate and upsert products from a CSV or JSON-lines text stream.
+
+    Rows are committed in batches of batch_size, so memory stays flat. A
+    batch the database rejects is retried row by row, so only the rows
+    that fail are lost. progress is called with the
+    running report after every batch.
+    """
+    report = {'processed': 0, 'imported': 0, 'failed': 0, 'errors': []}
+    batch = []
+    try:
+        for line, row in read_rows(stream, fmt):
+            report['processed'] += 1
+            try:
+                if isinstance(row, Exception):
+                    raise ValueError('Invalid JSON')
+                batch.append((line, validate_row(row)))
+            except ValueError as e:
+                _add_error(report, line, str(e))
+            if len(batch) >= batch_size:
+                _write_batch(batch, report)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            _write_batch(batch, report)
+            if progress:
+                progress(report)
+    finally:
+        # Earlier batches are committed even if reading the stream fails
+        product_cache.clear()
+    return report
+
+
+def export_products(fmt, batch_size=1000):
+    """Yield the catalog as CSV or JSON-lines text, one chunk per row."""
+    columns = [getattr(Product, c).label(c) for c in EXPORT_COLUMNS]
+    rows = db.session.execute(
+        select(*columns).order_by(Product.id).execution_options(yield_per=batch_size))
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps(dict(row._mapping)) + '\n'
+
+
+def _format_for(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path.endswith('.csv') else 'jsonl'
+
+
+@click.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def import_products_command(path, fmt, batch_size):
+    """Bulk import products from a CSV or JSON-lines file."""
+    def progress(report):
+        click.echo(f"{report['processed']} rows read, {report['imported']} imported, "
+                   f"{report['failed']} failed", err=True)
+
+    with open(path, newline='', encoding='utf-8') as stream:
+        report = import_products(stream, _format_for(path, fmt), batch_size, progress)
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(json.dumps({k: report[k] for k in ('processed', 'imported', 'failed')}))
+
+
+@click.command('export-products')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def export_products_command(path, fmt, batch_size):
+    """Stream the product catalog to a CSV or JSON-lines file."""
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        for chunk in export_products(_format_for(path, fmt), batch_size):
+            out.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(import_products_command)
+    app.cli.add_command(export_products_command)
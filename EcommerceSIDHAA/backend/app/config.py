@@ -0,0 +1,175 @@
+import os
+import sys
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your_secret_key')  # Change this in production
+    # A relative SQLite path lives in the instance folder. In-memory SQLite
+    # is only for tests: every pooled connection would see its own empty
+    # database, without the schema `flask db upgrade` creates
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool, ignored for in-memory SQLite which uses a single connection
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+    # Milliseconds; 0 disables. Enforced server side on PostgreSQL and MySQL
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+    # Pragmas applied to every connection of a file-backed SQLite database
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # negative means KiB
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+
+    # bcrypt work factor; existing hashes are upgraded on the next login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Processes used for password hashing; 0 hashes on the request thread
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+    # Matches ranked per search, 0 ranks all. A cap bounds latency of very
+    # broad queries but ranks only the oldest matches, so results are approximate
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 0))
+
+    # Seconds a login token stays valid
+    AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 7 * 24 * 3600))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+    # Where carts live: sql (the cart tables), memory or redis. The key-value
+    # backends write changed carts to SQL every CART_WRITE_BEHIND_INTERVAL seconds.
+    # memory keeps carts in the serving process, so it needs a single worker:
+    # with several, each would overwrite SQL with its own stale copy
+    CART_BACKEND = os.environ.get('CART_BACKEND', 'sql')
+    CART_REDIS_URL = os.environ.get('CART_REDIS_URL', 'redis://localhost:6379/0')
+    CART_WRITE_BEHIND_INTERVAL = float(os.environ.get('CART_WRITE_BEHIND_INTERVAL', 5))
+
+    # Requests slower than this log their SQL statements; 0 disables
+    SLOW_REQUEST_THRESHOLD_MS = int(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 0))
+
+    # Each running process writes JSON lines to its own LOG_DIR/ecommerce.<n>.log;
+    # a restarted worker reuses a free n, so the set of files stays bounded
+    LOG_DIR = os.environ.get('LOG_DIR', 'logs')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    LOG_REQUESTS = _env_bool('LOG_REQUESTS', True)
+
+    # Uploaded product images and their variants, stored by content hash
+    # and served from IMAGE_URL_PREFIX (a CDN may front it). The default is
+    # relative to the page's origin; the frontend dev server proxies it to
+    # the API. Serve the frontend elsewhere and this must be an absolute URL
+    IMAGE_DIR = os.environ.get('IMAGE_DIR', 'media/images')
+    IMAGE_URL_PREFIX = os.environ.get('IMAGE_URL_PREFIX', '/images')
+    IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 50_000_000))
+    # Processes rendering image variants; 0 renders them on the request thread
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', min(2, os.cpu_count() or 1)))
+
+    # Reverse proxies in front of the app (e.g. 1 behind nginx) whose
+    # X-Forwarded-For and X-Forwarded-Proto are trusted. Without it every
+    # proxied client has the proxy's address and shares one rate limit
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Requests per client as '<count>/<second|minute|hour|day>'. A client is
+    # the user of a valid token, otherwise the remote address. RATELIMITS
+    # gives endpoints their own budget (None is unlimited); all others share
+    # RATELIMIT_DEFAULT. The memory backend counts per process, redis across
+    # every worker
+    RATELIMIT_ENABLED = _env_bool('RATELIMIT_ENABLED', True)
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    RATELIMIT_MAX_KEYS = int(os.environ.get('RATELIMIT_MAX_KEYS', 100000))
+    RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '1200/minute')
+    RATELIMITS = {
+        'api.login': os.environ.get('RATELIMIT_LOGIN', '10/minute'),
+        'api.register': os.environ.get('RATELIMIT_REGISTER', '5/minute'),
+        'api.get_products': os.environ.get('RATELIMIT_CATALOG', '300/minute'),
+        'api.get_product': os.environ.get('RATELIMIT_CATALOG', '300/minute'),
+        'api.search_products_route': os.environ.get('RATELIMIT_SEARCH', '120/minute'),
+        'api.metrics': None,
+    }
+
+    PRODUCT_CACHE_BACKEND = os.environ.get('PRODUCT_CACHE_BACKEND', 'memory')
+    PRODUCT_CACHE_REDIS_URL = os.environ.get('PRODUCT_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    PRODUCT_CACHE_SIZE = int(os.environ.get('PRODUCT_CACHE_SIZE', 10000))
+    PRODUCT_CACHE_TTL = int(os.environ.get('PRODUCT_CACHE_TTL', 300))
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _is_green():
+    """True when gevent has monkey patched this process."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def engine_options(config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings."""
+    from sqlalchemy.engine import make_url
+
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if _is_memory_sqlite(url):
+        return {}
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if backend == 'sqlite':
+        # Seconds the driver waits on a locked database before raising
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}
+        if _is_green():
+            # SQLite waits for locks inside C, which would stall every
+            # greenlet in the worker, including the one holding the lock.
+            # One connection per process means greenlets queue for it
+            # cooperatively and never contend on SQLite locks themselves.
+            options['pool_size'] = 1
+            options['max_overflow'] = 0
+    elif timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    elif timeout and backend in ('mysql', 'mariadb'):
+        options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={timeout}'}
+    return options
+
+
+def configure_sqlite(engine, config):
+    """Open file-backed SQLite databases in WAL mode with tuned pragmas.
+
+    WAL lets readers in several worker processes proceed while one writer
+    commits, instead of every writer locking the whole file.
+    """
+    from sqlalchemy import event
+
+    if engine.url.get_backend_name() != 'sqlite' or _is_memory_sqlite(engine.url):
+        return
+
+    pragmas = [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT']),
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -0,0 +1,229 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Pillow format of an accepted upload -> extension of the stored original
+IMAGE_TYPES = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Variant name -> (longest side in pixels, Pillow format, extension)
+VARIANTS = {
+    'thumb': (200, 'JPEG', 'jpg'),
+    'thumb_webp': (200, 'WEBP', 'webp'),
+    'medium': (800, 'JPEG', 'jpg'),
+    'medium_webp': (800, 'WEBP', 'webp'),
+}
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+
+_DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _directory(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def _write_atomically(path, write):
+    """Call write(file) on a temporary file, then move it into place.
+
+    Readers never see a partial file, and concurrent writers of the same
+    content-addressed path simply replace each other's identical result.
+    """
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _flatten(image):
+    """RGB copy of image for JPEG, with any transparency composited on white."""
+    from PIL import Image
+
+    if image.mode in ('RGB', 'L'):
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def make_variants(root, digest, original):
+    """Render every missing variant of a stored original. Runs in the worker pool."""
+    from PIL import Image, ImageOps
+
+    directory = _directory(root, digest)
+    with Image.open(os.path.join(directory, original)) as image:
+        image = ImageOps.exif_transpose(image)
+        for name, (size, fmt, ext) in VARIANTS.items():
+            path = os.path.join(directory, f'{name}.{ext}')
+            if os.path.exists(path):
+                continue
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            if fmt == 'JPEG':
+                variant = _flatten(variant)
+            _write_atomically(path, lambda f: variant.save(f, fmt, **SAVE_OPTIONS[fmt]))
+
+
+class ImageStore:
+    """Product images stored on local disk under the SHA-256 of their bytes.
+
+    An upload is written once to <root>/<ab>/<digest>/original.<ext>, and
+    its resized JPEG and WebP variants are rendered next to it by a pool of
+    worker processes, off the request thread. Paths never change content,
+    so they can be cached forever. With workers=0 variants are rendered
+    inline, which is what the tests use.
+    """
+
+    def __init__(self, root='images', workers=0, max_bytes=10 * 1024 * 1024, max_pixels=50_000_000):
+        self.root = root
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}  # digest -> future of its variants, while rendering
+
+    def configure(self, root=None, workers=None, max_bytes=None, max_pixels=None):
+        """Change the settings, replacing any running pool."""
+        self.shutdown()
+        if root is not None:
+            self.root = root
+        if workers is not None:
+            self.workers = workers
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_pixels is not None:
+            self.max_pixels = max_pixels
+
+    def _submit(self, func, *args):
+        """Run func in the pool and return its future, or run it now without a pool."""
+        from concurrent.futures import Future
+
+        if not self.workers:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Spawned children import this module and Pillow, not Flask or SQLAlchemy
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+        return executor.submit(func, *args)
+
+    def _identify(self, data):
+        """Return the extension for data, or raise InvalidImage."""
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                fmt = image.format
+                width, height = image.size
+                image.verify()
+        except (Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+            raise InvalidImage('Not a readable image')
+        if fmt not in IMAGE_TYPES:
+            raise InvalidImage(f"Unsupported image type; use {', '.join(IMAGE_TYPES)}")
+        if width * height > self.max_pixels:
+            raise InvalidImage('Image has too many pixels')
+        return IMAGE_TYPES[fmt]
+
+    def save(self, data):
+        """Store an upload and schedule its variants; return its key, '<digest>.<ext>'."""
+        if len(data) > self.max_bytes:
+            raise InvalidImage('Image is too large')
+        ext = self._identify(data)
+        digest = hashlib.sha256(data).hexdigest()
+        directory = _directory(self.root, digest)
+        original = f'original.{ext}'
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(os.path.join(directory, original)):
+            _write_atomically(os.path.join(directory, original), lambda f: f.write(data))
+
+        self._render(digest, original)
+        return f'{digest}.{ext}'
+
+    def _render(self, digest, original):
+        """Future of the variants of digest, shared with any render already running."""
+        with self._lock:
+            future = self._pending.get(digest)
+        if future is not None:
+            return future
+        future = self._submit(make_variants, self.root, digest, original)
+        with self._lock:
+            future = self._pending.setdefault(digest, future)
+
+        def done(future):
+            with self._lock:
+                self._pending.pop(digest, None)
+            # Not fatal: path() renders missing variants on first request
+            if future.exception() is not None:
+                logger.error('Rendering variants of %s failed', digest, exc_info=future.exception())
+
+        future.add_done_callback(done)
+        return future
+
+    def path(self, digest, filename):
+        """Absolute path of an original or variant, or None if there is none.
+
+        A variant that the pool has not rendered yet is rendered now, so
+        its URL works as soon as the upload returns.
+        """
+        if not _DIGEST.fullmatch(digest):
+            return None
+        name, _, ext = filename.partition('.')
+        directory = os.path.abspath(_directory(self.root, digest))
+        if name == 'original':
+            if ext not in IMAGE_TYPES.values():
+                return None
+        elif VARIANTS.get(name, (None, None, None))[2] != ext:
+            return None
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+
+        originals = [f'original.{e}' for e in IMAGE_TYPES.values()
+                     if os.path.exists(os.path.join(directory, f'original.{e}'))]
+        if name == 'original' or not originals:
+            return None
+        self._render(digest, originals[0]).result()
+        return path
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def image_urls(key, prefix):
+    """URLs of the original and every variant of the image stored under key."""
+    if not key:
+        return None
+    digest, _, ext = key.partition('.')
+    urls = {'original': f'{prefix}/{digest}/original.{ext}'}
+    for name, (_, _, variant_ext) in VARIANTS.items():
+        urls[name] = f'{prefix}/{digest}/{name}.{variant_ext}'
+    return urls
@@ -0,0 +1,200 @@
+import atexit
+import copy
+import itertools
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+import weakref
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including any request context on the record."""
+
+    CONTEXT_FIELDS = ('request_id', 'method', 'path', 'status', 'duration_ms', 'remote_addr')
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'location': f'{record.pathname}:{record.lineno}',
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request ID and route."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            if not hasattr(record, 'path'):
+                record.method = request.method
+                record.path = request.path
+        return True
+
+
+class _ContextQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Merge args and render the traceback now: neither is safe to carry
+        # across the queue, and the request context is gone by the time the
+        # listener formats the record
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogWriter:
+    """Moves file I/O off the request thread.
+
+    Request threads only put records on an in-memory queue; a background
+    QueueListener thread writes them to a size-rotated file. Each running
+    process locks a numbered slot and writes ecommerce.<slot>.log, so
+    workers never race on rotation, and a restarted worker takes over the
+    file of the one it replaced instead of starting another.
+    """
+
+    def __init__(self, log_dir, max_bytes, backup_count, level):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = queue.SimpleQueue()
+        self.handler = _ContextQueueHandler(self.queue)
+        self.handler.setLevel(level)
+        self.handler.addFilter(RequestContextFilter())
+        self.listener = None
+        self.slot = None
+        self._slot_lock = None
+        _writers.add(self)
+
+    def path(self):
+        return os.path.join(self.log_dir, f'ecommerce.{self.slot}.log')
+
+    def _claim_slot(self):
+        """Lock the lowest slot no running process holds; the lock goes with the process."""
+        if fcntl is None:
+            self.slot = os.getpid()
+            return
+        for slot in itertools.count():
+            lock = open(os.path.join(self.log_dir, f'.ecommerce.{slot}.lock'), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            self.slot, self._slot_lock = slot, lock
+            return
+
+    def _release_slot(self):
+        if self._slot_lock is not None:
+            self._slot_lock.close()
+            self._slot_lock = None
+
+    def start(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._claim_slot()
+        file_handler = RotatingFileHandler(self.path(), maxBytes=self.max_bytes,
+                                           backupCount=self.backup_count, delay=True)
+        file_handler.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+        self._release_slot()
+
+    def restart_in_child(self):
+        # The listener thread does not survive fork; give the child its own
+        # thread, queue and slot. Closing the inherited lock file leaves the
+        # parent's lock in place.
+        if self.listener is None:
+            return
+        self.listener = None
+        self._release_slot()
+        self.queue = queue.SimpleQueue()
+        self.handler.queue = self.queue
+        self.start()
+
+
+# Registered once per process rather than once per app, for every writer
+# still alive
+_writers = weakref.WeakSet()
+
+
+def _stop_writers():
+    for writer in list(_writers):
+        writer.stop()
+
+
+def _restart_writers_in_child():
+    for writer in list(_writers):
+        writer.restart_in_child()
+
+
+atexit.register(_stop_writers)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_writers_in_child)
+
+
+def configure_logging(app):
+    """Route app.logger through a LogWriter and log one line per request."""
+    writer = LogWriter(app.config['LOG_DIR'], app.config['LOG_MAX_BYTES'],
+                       app.config['LOG_BACKUP_COUNT'], app.config['LOG_LEVEL'])
+    writer.start()
+
+    # Flask's default handler writes to stderr on the request thread
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(writer.handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.log_start = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if 'request_id' not in g:
+            return response
+        response.headers['X-Request-ID'] = g.request_id
+        if app.config['LOG_REQUESTS']:
+            app.logger.info(f'{request.method} {request.path} {response.status_code}', extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g.log_start) * 1000, 3),
+                'remote_addr': request.remote_addr,
+            })
+        return response
+
+    return writer
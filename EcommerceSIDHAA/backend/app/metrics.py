@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from app import db, product_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition model."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {k: (list(counts), total) for k, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket', _format_labels(self.labels, label_values, [('le', le)]), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labels, label_values), total
+            yield f'{self.name}_count', _format_labels(self.labels, label_values), cumulative
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, help, read=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._read = read
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, '', self._read() if self._read else self.value
+
+
+class Counter(Gauge):
+    """A value that only goes up, read from a callback."""
+
+    type = 'counter'
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests.', ('method', 'route', 'status'))
+response_size = Histogram(
+    'http_response_size_bytes', 'Size of non-streamed response bodies.', ('method', 'route'), SIZE_BUCKETS)
+request_queries = Histogram(
+    'db_queries_per_request', 'SQL statements executed per request.', ('route',), QUERY_COUNT_BUCKETS)
+request_query_time = Histogram(
+    'db_query_duration_seconds_per_request', 'Time spent in SQL per request.', ('route',))
+in_flight = Gauge('http_requests_in_flight', 'Requests currently being handled.')
+
+METRICS = [
+    request_duration,
+    response_size,
+    request_queries,
+    request_query_time,
+    in_flight,
+    Counter('product_cache_hits_total', 'Product cache hits.', lambda: product_cache.stats()['hits']),
+    Counter('product_cache_misses_total', 'Product cache misses.', lambda: product_cache.stats()['misses']),
+    Counter('product_cache_evictions_total', 'Product cache evictions.',
+            lambda: product_cache.stats()['evictions']),
+]
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_statements = [] if current_app.config['SLOW_REQUEST_THRESHOLD_MS'] else None
+    in_flight.add(1)
+
+
+def _record_request(response):
+    if 'metrics_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    route = _route()
+    request_duration.observe(elapsed, request.method, route, response.status_code)
+    if not response.is_streamed:
+        response_size.observe(response.calculate_content_length() or 0, request.method, route)
+    request_queries.observe(g.sql_count, route)
+    request_query_time.observe(g.sql_time, route)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD_MS']
+    if threshold and elapsed * 1000 >= threshold:
+        current_app.logger.warning(
+            f'Slow request {request.method} {request.full_path} took {elapsed * 1000:.1f}ms, '
+            f'{g.sql_count} queries in {g.sql_time * 1000:.1f}ms:\n' + '\n'.join(g.sql_statements))
+    return response
+
+
+def _finish_request(exc):
+    if g.pop('metrics_start', None) is not None:
+        in_flight.add(-1)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _failed_cursor_execute(context):
+    starts = context.connection.info.get('query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if g.sql_statements is not None:
+            g.sql_statements.append(f'  [{elapsed * 1000:.2f}ms] {statement}')
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_finish_request)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'handle_error', _failed_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
@@ -1,4 +1,19 @@
-from app import db, bcrypt
+from sqlalchemy import update
+from app import db, hasher
+from app.money import amount
+
+
+def conflict_insert(table):
+    """INSERT for `table` that supports ON CONFLICT clauses (SQLite and PostgreSQL)."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise RuntimeError(f'Upserts are not supported on {dialect}')
+    return insert(table)
+
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,10 +24,13 @@ class User(db.Model):
     orders = db.relationship('Order', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return hasher.check(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
 
     @classmethod
     def get_by_id(cls, user_id):
@@ -26,8 +44,46 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    price_cents = db.Column(db.Integer, nullable=False, index=True)
+    price = amount('price_cents')
     image_url = db.Column(db.String(255))
+    # '<sha256>.<ext>' of the uploaded image in app.images, if any
+    image_key = db.Column(db.String(80))
+    # Units available for sale; NULL means stock is not tracked
+    stock = db.Column(db.Integer)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    # Bumped by SQLAlchemy on every UPDATE; used to derive strong ETags
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+        # Serves the name prefix filter: SQLite only uses an index for a
+        # case-insensitive LIKE when the index is NOCASE
+        db.Index('ix_product_name', db.collate(name, 'NOCASE')).ddl_if(dialect='sqlite'),
+    )
+
+    @classmethod
+    def decrement_stock(cls, quantities, session=None):
+        """Atomically take stock for {product_id: quantity} within the current transaction.
+
+        Each row is decremented with a conditional UPDATE, so concurrent
+        checkouts can never drive stock below zero and only contend on the
+        rows they touch. Returns the first product ID that lacks stock, in
+        which case the caller must roll back; otherwise None.
+        """
+        session = session or db.session
+        # A fixed lock order keeps concurrent multi-item checkouts from deadlocking
+        for product_id, quantity in sorted(quantities.items()):
+            result = session.execute(
+                update(cls)
+                .where(cls.id == product_id)
+                .where(db.or_(cls.stock.is_(None), cls.stock >= quantity))
+                .values(stock=cls.stock - quantity, version=cls.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                return product_id
+        return None
 
     def __repr__(self):
         return f'<Product {self.name}>'
@@ -35,7 +91,8 @@ class Product(db.Model):
 
 class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # One cart per user; the unique index is also the conflict target for cart upserts
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True, index=True)
     items = db.relationship('CartItem', backref='cart', lazy=True)
 
     def __repr__(self):
@@ -45,19 +102,24 @@ class Cart(db.Model):
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     product = db.relationship('Product')
 
+    # A product appears once per cart. The index also serves every lookup by
+    # cart_id alone, and is the conflict target for add-to-cart upserts
+    __table_args__ = (db.Index('ix_cart_item_cart_id_product_id', 'cart_id', 'product_id', unique=True),)
+
     def __repr__(self):
         return f'<CartItem {self.id}>'
 
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
-    total_price = db.Column(db.Float, nullable=False)
+    total_cents = db.Column(db.Integer, nullable=False)
+    total_price = amount('total_cents')
     items = db.relationship('OrderItem', backref='order', lazy=True)
 
     def __repr__(self):
@@ -66,11 +128,36 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    # Unit price at the time of the order
+    price_cents = db.Column(db.Integer, nullable=False)
+    price = amount('price_cents')
     product = db.relationship('Product')
 
     def __repr__(self):
         return f'<OrderItem {self.id}>'
+
+
+class DailySales(db.Model):
+    """Orders, units sold and revenue per day (UTC), maintained by app.analytics."""
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    revenue_cents = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<DailySales {self.day}>'
+
+
+class ProductSales(db.Model):
+    """Orders, units sold and revenue per product, maintained by app.analytics."""
+    # No foreign key: sales history outlives deleted products
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False, index=True)
+    revenue_cents = db.Column(db.Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ProductSales {self.product_id}>'
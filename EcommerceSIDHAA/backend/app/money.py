@@ -0,0 +1,49 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy import Float, type_coerce
+from sqlalchemy.ext.hybrid import hybrid_property
+
+# Amounts are stored as integers in minor units, so sums and products in
+# SQL and Python are exact. The API keeps speaking major units.
+CENTS = 100
+
+
+def to_cents(value):
+    """Convert an amount in major units (number or numeric string) to integer cents.
+
+    The value goes through its decimal string, so 19.99 is 1999 and not
+    1998; fractions of a cent are rounded half up. Raises ValueError for
+    anything that is not a finite number.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f'Invalid amount: {value!r}')
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {value!r}')
+    if not amount.is_finite():
+        raise ValueError(f'Invalid amount: {value!r}')
+    return int((amount * CENTS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Amount in major units, as serialized by the API."""
+    return None if cents is None else cents / CENTS
+
+
+def amount(cents_attribute):
+    """A hybrid attribute reading and writing an integer-cents column in major units.
+
+    Lets models keep their price and total_price attributes: setting 12.5
+    stores 1250, and in queries the attribute is the column divided by 100.
+    """
+    def fget(self):
+        return from_cents(getattr(self, cents_attribute))
+
+    def fset(self, value):
+        setattr(self, cents_attribute, to_cents(value))
+
+    def expr(cls):
+        return type_coerce(getattr(cls, cents_attribute) / CENTS, Float)
+
+    return hybrid_property(fget, fset, expr=expr)
@@ -0,0 +1,64 @@
+import threading
+
+import bcrypt
+
+
+class PasswordHasher:
+    """bcrypt hashing offloaded to a bounded pool of worker processes.
+
+    bcrypt is pure CPU work; running it in separate processes keeps it off
+    the request thread and lets several logins hash in parallel. With
+    workers=0 hashing runs inline, which is what the tests use.
+    """
+
+    def __init__(self, rounds=12, workers=0):
+        self.rounds = rounds
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, rounds=None, workers=None):
+        """Change the work factor or pool size, replacing any running pool."""
+        self.shutdown()
+        if rounds is not None:
+            self.rounds = rounds
+        if workers is not None:
+            self.workers = workers
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        with self._lock:
+            if self._executor is None:
+                # Imported on first use: CLI commands and inline hashing never need a pool
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Spawned children only import bcrypt, not this application
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+        return executor.submit(func, *args).result()
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different work factor."""
+        # bcrypt hashes look like $2b$12$<salt+digest>
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
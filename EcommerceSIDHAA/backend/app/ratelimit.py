@@ -0,0 +1,195 @@
+import math
+import re
+import threading
+import time
+
+from flask import current_app, jsonify, request
+
+from app.auth import authenticate
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+_LIMIT = re.compile(r'\s*(\d+)\s*/\s*(second|minute|hour|day)\s*')
+
+
+class Limit:
+    """count requests per period seconds, in bursts of up to count."""
+
+    __slots__ = ('count', 'period', 'rate')
+
+    def __init__(self, count, period):
+        self.count = count
+        self.period = period
+        self.rate = count / period  # tokens refilled per second
+
+    @classmethod
+    def parse(cls, text):
+        """Parse '<count>/<second|minute|hour|day>'; None or '' means unlimited."""
+        if not text:
+            return None
+        match = _LIMIT.fullmatch(text)
+        if not match or int(match.group(1)) < 1:
+            raise ValueError(f'Invalid rate limit {text!r}; use e.g. 10/minute')
+        return cls(int(match.group(1)), PERIODS[match.group(2)])
+
+    def __repr__(self):
+        return f'Limit({self.count}, {self.period})'
+
+
+class TokenBuckets:
+    """In-process token buckets, one per key.
+
+    A bucket holds up to limit.count tokens and refills continuously at
+    limit.rate; each request takes one. Buckets that have refilled
+    completely are indistinguishable from new ones, so they are pruned
+    when the table reaches max_keys.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, updated, rate, capacity]
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, now=None):
+        """Take a token for key; return 0 if allowed, else seconds until one is available."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                self._buckets[key] = [limit.count - 1, now, limit.rate, limit.count]
+                return 0
+            tokens = min(limit.count, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / limit.rate
+
+    def _prune(self, now):
+        """Drop full buckets, then the least recently created if still at max_keys."""
+        buckets = self._buckets
+        for key in [key for key, (tokens, updated, rate, capacity) in buckets.items()
+                    if tokens + (now - updated) * rate >= capacity]:
+            del buckets[key]
+        excess = len(buckets) - self.max_keys * 9 // 10
+        if excess > 0:
+            for key in list(buckets)[:excess]:
+                del buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SlidingWindows:
+    """Sliding-window counters in a Redis-compatible store, shared by every worker.
+
+    Requests are counted in fixed windows of limit.period; the previous
+    window's count is weighted by how much of it the sliding window still
+    covers. Only INCR, EXPIRE and GET are needed, so a check is one
+    pipelined round trip with no server-side scripting.
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, limit, now=None):
+        """Count a request for key; return 0 if allowed, else seconds until one would be."""
+        if now is None:
+            now = time.time()
+        period = limit.period
+        window = int(now // period)
+        elapsed = now - window * period
+        current = f'{self.prefix}{key}:{window}'
+        pipe = self.client.pipeline()
+        pipe.incr(current)
+        pipe.expire(current, period * 2)
+        pipe.get(f'{self.prefix}{key}:{window - 1}')
+        count, _, previous = pipe.execute()
+        previous = int(previous or 0)
+        if previous * (period - elapsed) / period + count <= limit.count:
+            return 0
+        if count >= limit.count or not previous:
+            return period - elapsed
+        # The previous window's weight falls below the remaining allowance
+        return period * (1 - (limit.count - count) / previous) - elapsed
+
+
+class RateLimiter:
+    """Per-route request limits for each client, checked before every request.
+
+    A client is the user of a valid bearer token, otherwise the remote
+    address, which is the forwarded client address when TRUSTED_PROXIES is
+    set. Routes listed in limits are counted separately; every other
+    route shares the default limit. A route mapped to None is unlimited.
+    """
+
+    def __init__(self, store, default=None, limits=None):
+        self.store = store
+        self.default = default
+        self.limits = limits or {}
+
+    @staticmethod
+    def _client(environ):
+        scheme, _, token = environ.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if token and scheme.lower() == 'bearer':
+            user_id = authenticate(token.strip())
+            if user_id is not None:
+                return f'user:{user_id}'
+        return f'ip:{environ.get("REMOTE_ADDR")}'
+
+    def check(self):
+        """Return a 429 response if the current request is over its limit, else None."""
+        if not current_app.config['RATELIMIT_ENABLED']:
+            return None
+        # Each proxy lookup costs about as much as the bucket itself
+        req = request._get_current_object()
+        endpoint = req.endpoint
+        if endpoint in self.limits:
+            limit = self.limits[endpoint]
+        else:
+            limit, endpoint = self.default, 'default'
+        if limit is None:
+            return None
+        try:
+            retry_after = self.store.take(f'{endpoint}:{self._client(req.environ)}', limit)
+        except Exception:
+            # An unreachable shared store must not take the site down with it
+            current_app.logger.exception('Rate limit check failed; allowing request')
+            return None
+        if not retry_after:
+            return None
+        response = jsonify({'message': 'Too many requests'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+
+def create_rate_limit_store(config):
+    """Build the counter storage named by RATELIMIT_BACKEND: memory or redis."""
+    if config.get('RATELIMIT_BACKEND') == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_BACKEND=redis requires the redis package')
+        return SlidingWindows(redis.Redis.from_url(config['RATELIMIT_REDIS_URL']))
+    return TokenBuckets(max_keys=config['RATELIMIT_MAX_KEYS'])
+
+
+def init_app(app):
+    config = app.config
+    limiter = RateLimiter(
+        create_rate_limit_store(config),
+        default=Limit.parse(config['RATELIMIT_DEFAULT']),
+        limits={endpoint: Limit.parse(text) for endpoint, text in config['RATELIMITS'].items()},
+    )
+    app.extensions['rate_limiter'] = limiter
+    app.before_request(limiter.check)
@@ -1,9 +1,100 @@
-from flask import request, jsonify
-from app import app, db
+import datetime
+import hashlib
+import io
+from flask import Blueprint, Response, current_app, g, request, jsonify, send_file, stream_with_context
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from app import db, image_store, product_cache
 from app.models import User, Product, Cart, CartItem, Order, OrderItem
+from app.auth import issue_token, token_required
+from app.carts import CartNotFound, ItemNotInCart, cart_store
+from app.metrics import render as render_metrics
+from app.money import from_cents, to_cents
+from app.analytics import SORT_COLUMNS, record_order, sales_by_day, sales_totals, top_products
+from app.catalog import FORMATS, MAX_INTEGER, export_products, import_products
+from app.images import InvalidImage, image_urls
+from app.search import search_products
 # No utils needed for now
 
-@app.route('/register', methods=['POST'])
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'image_url', 'images', 'stock')
+# Fields computed from a differently named column
+PRODUCT_FIELD_COLUMNS = {'images': 'image_key'}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CART_OPERATIONS = ('add', 'set', 'remove')
+# Largest quantity one cart operation may add or set
+MAX_CART_QUANTITY = 10000
+# Image URLs embed the content hash, so a response never goes stale
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+bp = Blueprint('api', __name__)
+
+
+def _serialize(data):
+    return (current_app.json.dumps(data) + '\n').encode('utf-8')
+
+
+def _json_response(etag, body):
+    """Wrap an already serialized JSON body, as cached by product_cache.
+
+    Clients that send a matching If-None-Match get an empty 304 instead.
+    """
+    response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _stream_format():
+    """'ndjson' or 'json' when the client asked for a streamed collection."""
+    stream = request.args.get('stream')
+    if stream in ('ndjson', 'json'):
+        return stream
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    return None
+
+
+def _stream_response(stream_format, key, rows, extra=None):
+    """Stream rows as they are serialized instead of building the whole body.
+
+    'ndjson' writes one object per line. 'json' writes the same document the
+    non-streamed endpoint returns, {key: [...], **extra}, in chunks.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        if stream_format == 'ndjson':
+            for row in rows:
+                yield dumps(row) + '\n'
+            return
+        yield f'{{"{key}": ['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + dumps(row)
+        yield ']'
+        for name, value in (extra or {}).items():
+            yield f', {dumps(name)}: {dumps(value)}'
+        yield '}\n'
+
+    mimetype = NDJSON_MIMETYPE if stream_format == 'ndjson' else current_app.json.mimetype
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def _images(image_key):
+    return image_urls(image_key, current_app.config['IMAGE_URL_PREFIX'])
+
+
+def _product_row(row):
+    product = dict(row._mapping)
+    if 'images' in product:
+        product['images'] = _images(product['images'])
+    return product
+
+
+@bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     if not data or not 'username' in data or not 'email' in data or not 'password' in data:
@@ -23,7 +114,7 @@ def register():
     return jsonify({'message': 'User registered successfully'}), 201
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     if not data or not 'email' in data or not 'password' in data:
@@ -34,168 +125,370 @@ def login():
     if not user or not user.check_password(data['password']):
         return jsonify({'message': 'Invalid credentials'}), 401
 
-    return jsonify({'user_id': user.id}), 200
-
+    if user.password_needs_rehash():
+        user.set_password(data['password'])
+        db.session.commit()
 
-@app.route('/profile', methods=['GET'])
-def profile():
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
+    return jsonify({'user_id': user.id, 'token': issue_token(user.id)}), 200
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
 
+@bp.route('/profile', methods=['GET'])
+@token_required(load_user=True)
+def profile():
     return jsonify({
-        'username': user.username,
-        'email': user.email
+        'username': g.user['username'],
+        'email': g.user['email']
     })
 
 
-@app.route('/products', methods=['POST'])
-def create_product():
-    # TODO: Add admin role authorization check
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
+def _price_cents(value):
+    """to_cents for a product price; negative prices raise ValueError, as in imports."""
+    price_cents = to_cents(value)
+    if price_cents < 0:
+        raise ValueError('Price must not be negative')
+    return price_cents
+
+
+def _stock(value):
+    """A product's stock from a JSON body: null for untracked, else an int in the import's range."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= MAX_INTEGER:
+        raise ValueError(f'Invalid stock: {value!r}')
+    return value
+
+
+def _commit_product_write():
+    """Commit a change to one product, or return False if another request changed or deleted it first.
+
+    Product rows are versioned, so a write based on a stale read matches no
+    row and raises StaleDataError instead of silently overwriting.
+    """
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def _product_conflict():
+    return jsonify({'message': 'Product was changed by another request, try again'}), 409
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found or invalid ID!'}), 401
 
+@bp.route('/products', methods=['POST'])
+@token_required()
+def create_product():
+    # TODO: Add admin role authorization check
     data = request.get_json()
     if not data or not 'name' in data or not 'price' in data:
         return jsonify({'message': 'Missing data'}), 400
+    try:
+        price_cents = _price_cents(data['price'])
+    except ValueError:
+        return jsonify({'message': 'Invalid price'}), 400
+    try:
+        stock = _stock(data.get('stock'))
+    except ValueError:
+        return jsonify({'message': 'Invalid stock'}), 400
 
     product = Product(
         name=data['name'],
         description=data.get('description', ''),
-        price=data['price'],
-        image_url=data.get('image_url', '')
+        price_cents=price_cents,
+        image_url=data.get('image_url', ''),
+        stock=stock
     )
     db.session.add(product)
     db.session.commit()
+    product_cache.invalidate_listings()
 
     return jsonify({'message': 'Product created successfully'}), 201
 
 
-@app.route('/products', methods=['GET'])
+def _name_prefix(name):
+    """Case-insensitive match of product names starting with name.
+
+    SQLite serves this from the NOCASE ix_product_name only when the LIKE
+    pattern is bound whole, so it is built here rather than in SQL.
+    """
+    pattern = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return Product.name.like(pattern, escape='\\')  # LIKE is case-insensitive for ASCII
+    return Product.name.ilike(pattern, escape='\\')
+
+
+@bp.route('/products', methods=['GET'])
 def get_products():
-    products = Product.query.all()
-    output = []
-    for product in products:
+    fields = request.args.get('fields')
+    if fields:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+        if unknown:
+            return jsonify({'message': f"Unknown field(s): {', '.join(unknown)}"}), 400
+        # The id is always loaded since it doubles as the pagination cursor
+        fields = ['id'] + [f for f in fields if f != 'id']
+    else:
+        fields = list(PRODUCT_FIELDS)
+
+    query = Product.query.with_entities(
+        *[getattr(Product, PRODUCT_FIELD_COLUMNS.get(f, f)).label(f) for f in fields])
+    after = request.args.get('after', type=int)
+    min_price = request.args.get('min_price', type=to_cents)
+    max_price = request.args.get('max_price', type=to_cents)
+    name = request.args.get('name')
+    if after is not None:
+        query = query.filter(Product.id > after)
+    if min_price is not None:
+        query = query.filter(Product.price_cents >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price_cents <= max_price)
+    if name:
+        query = query.filter(_name_prefix(name))
+    query = query.order_by(Product.id)
+
+    stream_format = _stream_format()
+    if stream_format:
+        # Streams are not paged; limit is honoured only when given
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            query = query.limit(max(1, limit))
+        rows = (_product_row(row) for row in query.yield_per(STREAM_BATCH_SIZE))
+        return _stream_response(stream_format, 'products', rows, {'next_cursor': None})
+
+    def build():
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        # Fetch one extra row to know whether another page follows
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        output = [_product_row(row) for row in rows]
+        next_cursor = rows[-1].id if has_more else None
+        body = _serialize({'products': output, 'next_cursor': next_cursor})
+        return hashlib.sha256(body).hexdigest()[:32], body
+
+    etag, body = product_cache.get_or_build(product_cache.listing_key(request.args), build)
+    return _json_response(etag, body)
+
+
+@bp.route('/products/search', methods=['GET'])
+def search_products_route():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'message': 'Missing search query'}), 400
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    results = search_products(query, limit + 1, offset, current_app.config['SEARCH_MAX_CANDIDATES'])
+    next_offset = offset + limit if len(results) > limit else None
+    return jsonify({'products': results[:limit], 'next_offset': next_offset})
+
+
+@bp.route('/products/import', methods=['POST'])
+@token_required()
+def import_products_route():
+    # TODO: Add admin role authorization check
+    fmt = request.args.get('format', 'csv' if request.mimetype == 'text/csv' else 'jsonl')
+    if fmt not in FORMATS:
+        return jsonify({'message': 'Unsupported format'}), 400
+    batch_size = max(1, request.args.get('batch_size', 1000, type=int))
+
+    def progress(report):
+        current_app.logger.info(f"Product import: {report['processed']} rows read, "
+                        f"{report['imported']} imported, {report['failed']} failed")
+
+    # Read the upload incrementally instead of buffering the whole body
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    report = import_products(stream, fmt, batch_size, progress)
+    return jsonify(report)
+
+
+@bp.route('/products/export', methods=['GET'])
+@token_required()
+def export_products_route():
+    # TODO: Add admin role authorization check
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        return jsonify({'message': 'Unsupported format'}), 400
+
+    mimetype = 'text/csv' if fmt == 'csv' else NDJSON_MIMETYPE
+    return Response(stream_with_context(export_products(fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=products.{fmt}'})
+
+
+@bp.route('/products/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    def build():
+        product = Product.query.get_or_404(product_id)
         product_data = {
             'id': product.id,
             'name': product.name,
             'description': product.description,
             'price': product.price,
-            'image_url': product.image_url
+            'image_url': product.image_url,
+            'images': _images(product.image_key),
+            'stock': product.stock
         }
-        output.append(product_data)
-
-    return jsonify({'products': output})
+        return f'{product.id}-{product.version}', _serialize({'product': product_data})
 
+    etag, body = product_cache.get_or_build(product_cache.product_key(product_id), build)
+    return _json_response(etag, body)
 
-@app.route('/products/<int:product_id>', methods=['GET'])
-def get_product(product_id):
-    product = Product.query.get_or_404(product_id)
-    product_data = {
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'price': product.price,
-        'image_url': product.image_url
-    }
-    return jsonify({'product': product_data})
 
-
-@app.route('/products/<int:product_id>', methods=['PUT'])
+@bp.route('/products/<int:product_id>', methods=['PUT'])
+@token_required()
 def update_product(product_id):
     # TODO: Add admin role authorization check
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found or invalid ID!'}), 401
-
     try:
         product = Product.query.get_or_404(product_id)
         data = request.get_json()
+        try:
+            stock = _stock(data['stock']) if 'stock' in data else product.stock
+        except ValueError:
+            return jsonify({'message': 'Invalid stock'}), 400
 
         product.name = data.get('name', product.name)
         product.description = data.get('description', product.description)
-        product.price = data.get('price', product.price)
+        if 'price' in data:
+            product.price_cents = _price_cents(data['price'])
         product.image_url = data.get('image_url', product.image_url)
+        product.stock = stock
 
-        db.session.commit()
+        if not _commit_product_write():
+            return _product_conflict()
+        product_cache.invalidate_product(product_id)
 
         return jsonify({'message': 'Product updated successfully'})
+    except ValueError:
+        db.session.rollback()
+        return jsonify({'message': 'Invalid price'}), 400
     except Exception as e:
-        app.logger.error(f"Error updating product: {e}")
+        current_app.logger.error(f"Error updating product: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
 
-@app.route('/products/<int:product_id>', methods=['DELETE'])
+@bp.route('/products/<int:product_id>', methods=['DELETE'])
+@token_required()
 def delete_product(product_id):
     # TODO: Add admin role authorization check
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found or invalid ID!'}), 401
-
     product = Product.query.get_or_404(product_id)
     db.session.delete(product)
-    db.session.commit()
+    if not _commit_product_write():
+        return _product_conflict()
+    product_cache.invalidate_product(product_id)
 
     return jsonify({'message': 'Product deleted successfully'})
 
 
-@app.route('/cart', methods=['GET'])
-def get_cart():
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
-
-    cart = user.cart
-    if not cart:
-        return jsonify({'items': [], 'total': 0})
-
+@bp.route('/products/<int:product_id>/image', methods=['POST'])
+@token_required()
+def upload_product_image(product_id):
+    # TODO: Add admin role authorization check
+    product = Product.query.get_or_404(product_id)
+    # A multipart 'image' field or the raw request body
+    upload = request.files.get('image')
+    stream = upload.stream if upload else request.stream
+    # One byte over the limit is enough to reject the upload without reading it all
+    data = stream.read(image_store.max_bytes + 1)
+    if len(data) > image_store.max_bytes:
+        return jsonify({'message': 'Image is too large'}), 413
+    try:
+        product.image_key = image_store.save(data)
+    except InvalidImage as e:
+        return jsonify({'message': str(e)}), 400
+
+    images = _images(product.image_key)
+    # Clients that only know image_url get a resized copy, not the original
+    product.image_url = images['medium']
+    if not _commit_product_write():
+        return _product_conflict()
+    product_cache.invalidate_product(product_id)
+    return jsonify({'images': images}), 201
+
+
+@bp.route('/images/<digest>/<filename>', methods=['GET'])
+def get_image(digest, filename):
+    path = image_store.path(digest, filename)
+    if path is None:
+        return jsonify({'message': 'Image not found'}), 404
+    response = send_file(path, max_age=IMAGE_MAX_AGE, etag=f'{digest}-{filename}', conditional=True)
+    response.cache_control.immutable = True
+    return response
+
+
+def _cart_contents(user_id):
+    items = cart_store.items(user_id)
+    if not items:
+        return {'items': [], 'total': 0}
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_([i[1] for i in items]))}
     output = []
-    total = 0
-    for item in cart.items:
+    total_cents = 0
+    for item_id, product_id, quantity in items:
+        product = products.get(product_id)
+        if not product:
+            continue
         item_data = {
-            'id': item.id,
-            'product_id': item.product_id,
-            'name': item.product.name,
-            'price': item.product.price,
-            'quantity': item.quantity
+            'id': item_id,
+            'product_id': product_id,
+            'name': product.name,
+            'price': product.price,
+            'quantity': quantity
         }
         output.append(item_data)
-        total += item.product.price * item.quantity
+        total_cents += product.price_cents * quantity
 
-    return jsonify({'items': output, 'total': total})
+    return {'items': output, 'total': from_cents(total_cents)}
 
 
-@app.route('/cart/add', methods=['POST'])
-def add_to_cart():
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
+@bp.route('/cart', methods=['GET'])
+@token_required()
+def get_cart():
+    return jsonify(_cart_contents(g.user_id))
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
 
+def _is_int(value):
+    # bool is an int subclass, but true is not a product ID or a quantity
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@bp.route('/cart', methods=['PATCH'])
+@token_required()
+def patch_cart():
+    data = request.get_json()
+    if not data or not isinstance(data.get('operations'), list):
+        return jsonify({'message': 'Missing operations'}), 400
+
+    operations = []
+    for index, operation in enumerate(data['operations']):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        product_id = operation.get('product_id') if op else None
+        quantity = operation.get('quantity', 0) if op else None
+        if op not in CART_OPERATIONS or not _is_int(product_id) or not 0 < product_id <= MAX_INTEGER \
+                or not _is_int(quantity) \
+                or abs(quantity) > MAX_CART_QUANTITY or (op != 'remove' and 'quantity' not in operation):
+            return jsonify({'message': 'Invalid operation', 'index': index}), 400
+        operations.append((op, product_id, quantity))
+
+    # Validate every product that may end up in the cart with one IN query
+    wanted = {product_id for op, product_id, _ in operations if op != 'remove'}
+    found = {row.id for row in Product.query.with_entities(Product.id).filter(Product.id.in_(wanted))}
+    missing = sorted(wanted - found)
+    if missing:
+        return jsonify({'message': 'Product not found!', 'product_ids': missing}), 404
+
+    cart_store.apply(g.user_id, operations)
+    return jsonify(_cart_contents(g.user_id))
+
+
+@bp.route('/cart/add', methods=['POST'])
+@token_required()
+def add_to_cart():
     data = request.get_json()
     if not data or not 'product_id' in data or not 'quantity' in data:
         return jsonify({'message': 'Missing data'}), 400
@@ -203,150 +496,147 @@ def add_to_cart():
     product_id = data['product_id']
     quantity = data['quantity']
 
-    product = Product.query.get(product_id)
-    if not product:
+    if not db.session.query(Product.query.filter_by(id=product_id).exists()).scalar():
         return jsonify({'message': 'Product not found!'}), 404
 
-    cart = user.cart
-    if not cart:
-        cart = Cart(user_id=user.id)
-        db.session.add(cart)
-
-    cart_item = CartItem.query.filter_by(cart_id=cart.id, product_id=product.id).first()
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(cart_id=cart.id, product_id=product.id, quantity=quantity)
-        db.session.add(cart_item)
-
-    db.session.commit()
+    cart_store.add(g.user_id, product_id, quantity)
     return jsonify({'message': 'Item added to cart successfully'})
 
 
-@app.route('/cart/update/<int:product_id>', methods=['PUT'])
+@bp.route('/cart/update/<int:product_id>', methods=['PUT'])
+@token_required()
 def update_cart_item(product_id):
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
-
-    cart = user.cart
-    if not cart:
-        return jsonify({'message': 'Cart not found!'}), 404
-
-    cart_item = CartItem.query.filter_by(cart_id=cart.id, product_id=product_id).first()
-    if not cart_item:
-        return jsonify({'message': 'Item not in cart!'}), 404
-
     data = request.get_json()
     if not data or not 'quantity' in data:
         return jsonify({'message': 'Missing quantity'}), 400
 
-    quantity = data['quantity']
-    if quantity <= 0:
-        db.session.delete(cart_item)
-    else:
-        cart_item.quantity = quantity
+    try:
+        cart_store.update(g.user_id, product_id, data['quantity'])
+    except CartNotFound:
+        return jsonify({'message': 'Cart not found!'}), 404
+    except ItemNotInCart:
+        return jsonify({'message': 'Item not in cart!'}), 404
 
-    db.session.commit()
     return jsonify({'message': 'Cart updated successfully'})
 
 
-@app.route('/cart/remove/<int:product_id>', methods=['DELETE'])
+@bp.route('/cart/remove/<int:product_id>', methods=['DELETE'])
+@token_required()
 def remove_from_cart(product_id):
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
-
-    cart = user.cart
-    if not cart:
+    try:
+        cart_store.remove(g.user_id, product_id)
+    except CartNotFound:
         return jsonify({'message': 'Cart not found!'}), 404
-
-    cart_item = CartItem.query.filter_by(cart_id=cart.id, product_id=product_id).first()
-    if not cart_item:
+    except ItemNotInCart:
         return jsonify({'message': 'Item not in cart!'}), 404
 
-    db.session.delete(cart_item)
-    db.session.commit()
-
     return jsonify({'message': 'Item removed from cart successfully'})
 
 
-@app.route('/orders/create', methods=['POST'])
+@bp.route('/orders/create', methods=['POST'])
+@token_required()
 def create_order():
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
+    # Carts held outside SQL are written to their tables first
+    cart_store.materialize(g.user_id)
+    db.session.commit()
 
-    cart = user.cart
-    if not cart or not cart.items:
+    # Everything below runs in one transaction: the order, its items and
+    # the emptied cart are committed together or not at all. Deleting the
+    # cart items claims them and is the transaction's first statement, so
+    # a concurrent checkout of the same cart waits for this one and then
+    # finds nothing left to order.
+    claimed = db.session.execute(
+        delete(CartItem)
+        .where(CartItem.cart_id == select(Cart.id).where(Cart.user_id == g.user_id).scalar_subquery())
+        .returning(CartItem.product_id, CartItem.quantity)
+    ).all()
+    if not claimed:
+        db.session.rollback()
         return jsonify({'message': 'Cart is empty!'}), 400
 
-    total_price = 0
-    for item in cart.items:
-        total_price += item.product.price * item.quantity
-
-    order = Order(user_id=user.id, total_price=total_price)
+    quantities = {}
+    for product_id, quantity in claimed:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    out_of_stock = Product.decrement_stock(quantities)
+    if out_of_stock is not None:
+        db.session.rollback()
+        return jsonify({'message': 'Insufficient stock!', 'product_id': out_of_stock}), 409
+
+    prices = dict(db.session.query(Product.id, Product.price_cents).filter(Product.id.in_(quantities)))
+    order = Order(user_id=g.user_id,
+                  total_cents=sum(prices[product_id] * quantity for product_id, quantity in quantities.items()))
     db.session.add(order)
-    db.session.commit() # Commit to get the order ID
-
-    for item in cart.items:
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price=item.product.price
-        )
-        db.session.add(order_item)
-
-    # Clear the cart
-    for item in cart.items:
-        db.session.delete(item)
-
-    db.session.delete(cart)
+    db.session.flush()  # Assigns the order ID without committing
+
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order.id, 'product_id': product_id, 'quantity': quantity, 'price_cents': prices[product_id]}
+        for product_id, quantity in quantities.items()
+    ])
+    db.session.execute(delete(Cart).where(Cart.user_id == g.user_id))
+    record_order(order.id)
     db.session.commit()
+    cart_store.clear(g.user_id)
+    for product_id in quantities:
+        product_cache.invalidate_product(product_id)
 
     return jsonify({'message': 'Order created successfully', 'order_id': order.id}), 201
 
 
-@app.route('/orders', methods=['GET'])
+@bp.route('/orders', methods=['GET'])
+@token_required()
 def get_orders():
-    user_id = request.headers.get('x-user-id')
-    if not user_id:
-        return jsonify({'message': 'User ID is missing!'}), 401
-
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': 'User not found!'}), 404
+    orders = Order.query.filter_by(user_id=g.user_id).options(
+        selectinload(Order.items).joinedload(OrderItem.product)
+    ).order_by(Order.id)
 
-    orders = user.orders
-    output = []
-    for order in orders:
-        order_data = {
+    def serialize_order(order):
+        return {
             'id': order.id,
             'created_at': order.created_at,
             'total_price': order.total_price,
-            'items': []
-        }
-        for item in order.items:
-            item_data = {
+            'items': [{
                 'product_id': item.product_id,
                 'name': item.product.name,
                 'quantity': item.quantity,
                 'price': item.price
-            }
-            order_data['items'].append(item_data)
-        output.append(order_data)
+            } for item in order.items]
+        }
+
+    stream_format = _stream_format()
+    if stream_format:
+        rows = (serialize_order(order) for order in orders.yield_per(STREAM_BATCH_SIZE))
+        return _stream_response(stream_format, 'orders', rows)
+
+    return jsonify({'orders': [serialize_order(order) for order in orders]})
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    return datetime.date.fromisoformat(value) if value else None
+
+
+@bp.route('/analytics/sales', methods=['GET'])
+@token_required()
+def sales_analytics():
+    # TODO: Add admin role authorization check
+    try:
+        start, end = _date_arg('start'), _date_arg('end')
+    except ValueError:
+        return jsonify({'message': 'Dates must be YYYY-MM-DD'}), 400
+    return jsonify({'days': sales_by_day(start, end), 'totals': sales_totals(start, end)})
+
+
+@bp.route('/analytics/products', methods=['GET'])
+@token_required()
+def product_analytics():
+    # TODO: Add admin role authorization check
+    sort = request.args.get('sort', 'revenue')
+    if sort not in SORT_COLUMNS:
+        return jsonify({'message': f"sort must be one of: {', '.join(SORT_COLUMNS)}"}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_PAGE_SIZE))
+    return jsonify({'products': top_products(sort, limit)})
+
 
-    return jsonify({'orders': output})
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,137 @@
+import html
+import re
+
+from flask import current_app
+from sqlalchemy import DDL, event, or_, text
+
+from app import db
+from app.images import image_urls
+from app.models import Product
+
+# External-content FTS5 index over product name and description. The
+# triggers keep it in step with every INSERT, UPDATE and DELETE on product,
+# including bulk statements that bypass the ORM. Mirrored by the
+# c52e8f7b1d90 migration.
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, description, content='product', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+# Name matches weigh more than description matches in the BM25 score,
+# which FTS5 computes as its rank column while it sorts the matches, so
+# only the requested page leaves the index. Highlights are added
+# afterwards in Python for the returned page only, which is far cheaper
+# than asking FTS5 to re-run the match for them.
+SEARCH_SQL = text("""
+    SELECT rowid AS id, rank AS score
+    FROM product_fts WHERE product_fts MATCH :match AND rank MATCH 'bm25(10.0, 1.0)'
+    ORDER BY rank, rowid
+    LIMIT :limit OFFSET :offset
+""")
+# Opt-in bound for very broad prefixes: ranks only the first :candidates
+# matches. FTS5 yields matches in rowid order, so better matches in newer
+# products are missed; results are approximate.
+CAPPED_SEARCH_SQL = text("""
+    SELECT id, score FROM (
+        SELECT rowid AS id, bm25(product_fts, 10.0, 1.0) AS score
+        FROM product_fts WHERE product_fts MATCH :match
+        LIMIT :candidates
+    )
+    ORDER BY score, id
+    LIMIT :limit OFFSET :offset
+""")
+SNIPPET_WORDS = 16
+
+
+for statement in FTS_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS product_fts').execute_if(dialect='sqlite'))
+
+
+def match_expression(terms):
+    """Build an FTS5 query where every term is a prefix match.
+
+    Terms are quoted, so FTS5 operators typed by users are searched for
+    literally instead of being interpreted.
+    """
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight(text, terms):
+    """HTML of text with words starting with any of terms wrapped in <mark>.
+
+    The text itself is escaped, so product names cannot inject markup into
+    clients that render highlights as HTML.
+    """
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in terms) + r')\w*', re.IGNORECASE)
+    parts = []
+    end = 0
+    for match in pattern.finditer(text):
+        parts.append(html.escape(text[end:match.start()]))
+        parts.append(f'<mark>{html.escape(match.group(0))}</mark>')
+        end = match.end()
+    parts.append(html.escape(text[end:]))
+    return ''.join(parts)
+
+
+def snippet(text, terms):
+    """Highlight the first SNIPPET_WORDS words around the first match."""
+    words = text.split()
+    lowered = [t.lower() for t in terms]
+    first = next((i for i, word in enumerate(words)
+                  if any(word.lower().lstrip('([\'"').startswith(t) for t in lowered)), 0)
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(words) - SNIPPET_WORDS))
+    end = start + SNIPPET_WORDS
+    excerpt = ' '.join(words[start:end])
+    return ('...' if start else '') + highlight(excerpt, terms) + ('...' if end < len(words) else '')
+
+
+def _serialize(product, terms, score):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'image_url': product.image_url,
+        'images': image_urls(product.image_key, current_app.config['IMAGE_URL_PREFIX']),
+        'name_highlight': highlight(product.name, terms),
+        'description_snippet': snippet(product.description, terms),
+        'score': score,
+    }
+
+
+def search_products(query, limit, offset, candidates=0):
+    """Return ranked matches for query as a list of dicts.
+
+    candidates caps how many matches are ranked, at the cost of missing
+    better matches beyond the cap; 0 ranks them all.
+    """
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return []
+
+    if db.session.get_bind().dialect.name == 'sqlite':
+        params = {'match': match_expression(terms), 'limit': limit, 'offset': offset}
+        if candidates:
+            ranked = db.session.execute(CAPPED_SEARCH_SQL, dict(params, candidates=candidates)).all()
+        else:
+            ranked = db.session.execute(SEARCH_SQL, params).all()
+        products = {p.id: p for p in Product.query.filter(Product.id.in_([r.id for r in ranked]))}
+        return [_serialize(products[r.id], terms, r.score) for r in ranked]
+
+    # Without FTS5, fall back to unranked substring matching
+    products = Product.query.filter(or_(
+        Product.name.icontains(query, autoescape=True),
+        Product.description.icontains(query, autoescape=True),
+    )).order_by(Product.id).limit(limit).offset(offset)
+    return [_serialize(p, terms, None) for p in products]
@@ -0,0 +1,87 @@
+"""Hammer the stock decrement used at checkout from many threads.
+
+Every thread repeatedly buys one unit of the same product on its own
+connection to a shared file-backed database. Reports checkouts/sec and
+verifies that exactly the available stock was sold:
+
+    python -m benchmarks.checkout_contention --stock 500 --threads 16
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from flask import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import db
+from app.config import Config as AppConfig, configure_sqlite, engine_options
+from app.models import Product
+
+
+def run(uri, stock, threads, attempts):
+    config = Config('')
+    config.from_object(AppConfig)
+    config['SQLALCHEMY_DATABASE_URI'] = uri
+    engine = create_engine(uri, **engine_options(config))
+    configure_sqlite(engine, config)
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        product = Product(name='Flash sale item', description='', price=1.0, stock=stock)
+        session.add(product)
+        session.commit()
+        product_id = product.id
+
+    succeeded = []
+    start_barrier = threading.Barrier(threads)
+
+    def buyer():
+        start_barrier.wait()
+        for _ in range(attempts):
+            with Session(engine) as session:
+                if Product.decrement_stock({product_id: 1}, session=session) is None:
+                    session.commit()
+                    succeeded.append(1)
+                else:
+                    session.rollback()
+
+    workers = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    with Session(engine) as session:
+        final_stock = session.get(Product, product_id).stock
+    engine.dispose()
+    return {
+        'attempts': threads * attempts,
+        'succeeded': len(succeeded),
+        'final_stock': final_stock,
+        'seconds': round(elapsed, 3),
+        'checkouts_per_sec': round(threads * attempts / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = run(f'sqlite:///{tmp}/checkout.db', args.stock, args.threads, args.attempts)
+    oversold = stats['succeeded'] - args.stock
+    print(json.dumps(dict(stats, benchmark='checkout_contention', oversold=max(oversold, 0)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
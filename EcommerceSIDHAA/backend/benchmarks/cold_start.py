@@ -0,0 +1,79 @@
+"""Measure cold start: importing the package and building the app.
+
+Every sample runs in a fresh interpreter, so nothing is cached in
+sys.modules. Reports the median and minimum wall time of each stage, and
+the slowest top-level imports of a full start from `python -X importtime`,
+as JSON:
+
+    python -m benchmarks.cold_start --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = {
+    'import app': 'import app',
+    'create_app': 'import app; app.create_app()',
+}
+
+
+def _run(args):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    return subprocess.run([sys.executable] + args, cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def wall_ms(code):
+    """Milliseconds code takes to run in a fresh interpreter."""
+    timed = f'import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)'
+    return float(_run(['-c', timed]).stdout.split()[-1]) * 1000
+
+
+def import_times(code):
+    """Run code in a fresh interpreter and return {module: (cumulative µs, depth)}.
+
+    Nested imports are counted in their parent's cumulative time; depth 1
+    marks the modules code imported directly.
+    """
+    result = _run(['-X', 'importtime', '-c', code])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        times[name.strip()] = (int(cumulative), depth)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    stages = {}
+    for name, code in STAGES.items():
+        samples = [wall_ms(code) for _ in range(args.runs)]
+        stages[name] = {'median_ms': round(statistics.median(samples), 1), 'min_ms': round(min(samples), 1)}
+
+    startup = import_times('pass')  # Imported by the interpreter itself
+    full = import_times(STAGES['create_app'])
+    slowest = sorted(((us, name) for name, (us, depth) in full.items()
+                      if depth == 1 and name not in startup), reverse=True)
+    print(json.dumps({
+        'benchmark': 'cold_start',
+        'runs': args.runs,
+        'stages': stages,
+        'slowest_imports_ms': {name: round(us / 1000, 1) for us, name in slowest[:args.top]},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""Drive every API route concurrently against a seeded database.
+
+Seeds a temporary file-backed SQLite database with users, products, carts
+and orders, then sends --requests requests to each endpoint from --threads
+threads through the test client. Reports throughput and latency
+percentiles per endpoint as JSON:
+
+    python -m benchmarks.endpoints --products 20000 --requests 500 > before.json
+    python -m benchmarks.endpoints --products 20000 --requests 500 --baseline before.json
+
+With --baseline, every endpoint also reports the percentage change of its
+throughput and latency against that earlier run. --endpoints takes a comma
+separated list of names such as "GET /products,POST /orders/create".
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.search_latency import WORDS, percentile
+
+PASSWORD = 'bench-password'
+ITEMS_PER_CART = 3
+ITEMS_PER_ORDER = 3
+IMPORT_ROWS = 50
+
+# prepare(ctx, n) runs untimed and returns one argument per request;
+# call(client, ctx, arg) sends the request
+Endpoint = namedtuple('Endpoint', 'name status prepare call')
+
+
+class Context:
+    """Seeded row IDs and a cache of auth headers shared by the endpoints."""
+
+    def __init__(self, db, user_ids, cart_user_ids, order_user_ids, product_ids, cart_items):
+        self.db = db
+        self.user_ids = user_ids
+        self.cart_user_ids = cart_user_ids
+        self.order_user_ids = order_user_ids
+        self.product_ids = product_ids
+        self.cart_items = cart_items
+        self.rng = random.Random(7)
+        self._headers = {}
+
+    def headers(self, user_id):
+        from app.auth import issue_token
+        if user_id not in self._headers:
+            self._headers[user_id] = {'Authorization': f'Bearer {issue_token(user_id)}'}
+        return self._headers[user_id]
+
+    def sample(self, population, n):
+        return [self.rng.choice(population) for _ in range(n)]
+
+    def new_users(self, n, items_per_cart=0):
+        """Insert n users, each with a cart of items_per_cart products."""
+        from app.models import Cart, CartItem, User
+        prefix = f'extra{time.perf_counter_ns()}'
+        password_hash = self.db.session.query(User.password_hash).limit(1).scalar()
+        user_ids = _insert(self.db, User, [
+            {'username': f'{prefix}-{i}', 'email': f'{prefix}-{i}@example.com', 'password_hash': password_hash}
+            for i in range(n)])
+        if items_per_cart:
+            cart_ids = _insert(self.db, Cart, [{'user_id': user_id} for user_id in user_ids])
+            _insert(self.db, CartItem, [
+                {'cart_id': cart_id, 'product_id': product_id, 'quantity': 1}
+                for cart_id in cart_ids for product_id in self.rng.sample(self.product_ids, items_per_cart)])
+        self.db.session.commit()
+        return user_ids
+
+
+def _insert(db, model, rows):
+    """Insert rows in bulk and return their new IDs in order."""
+    if not rows:
+        return []
+    table = model.__table__
+    start = db.session.query(db.func.coalesce(db.func.max(table.c.id), 0)).scalar() + 1
+    for i, row in enumerate(rows):
+        row['id'] = start + i
+    db.session.execute(table.insert(), rows)
+    return list(range(start, start + len(rows)))
+
+
+def seed(db, users, products, carts, orders):
+    from app import hasher
+    from app.analytics import rebuild as rebuild_sales_summary
+    from app.models import Cart, CartItem, Order, OrderItem, Product, User
+
+    rng = random.Random(42)
+    # One hash shared by every seeded user; hashing each would dominate seeding
+    password_hash = hasher.hash(PASSWORD)
+    user_ids = _insert(db, User, [
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': password_hash}
+        for i in range(users)])
+
+    product_ids = []
+    for start in range(0, products, 20000):
+        product_ids += _insert(db, Product, [{
+            'name': ' '.join(rng.choices(WORDS, k=3)),
+            'description': ' '.join(rng.choices(WORDS, k=20)),
+            'price_cents': rng.randint(100, 50000),
+            'image_url': '',
+            'stock': None,
+        } for _ in range(min(20000, products - start))])
+        db.session.commit()
+        print(f'seeded {len(product_ids)}/{products} products', file=sys.stderr)
+
+    cart_user_ids = user_ids[:carts]
+    cart_ids = _insert(db, Cart, [{'user_id': user_id} for user_id in cart_user_ids])
+    cart_items = {}
+    item_rows = []
+    for user_id, cart_id in zip(cart_user_ids, cart_ids):
+        cart_items[user_id] = rng.sample(product_ids, ITEMS_PER_CART)
+        item_rows += [{'cart_id': cart_id, 'product_id': p, 'quantity': 1} for p in cart_items[user_id]]
+    _insert(db, CartItem, item_rows)
+
+    order_user_ids = user_ids[-max(1, users // 2):]
+    order_user_of = [order_user_ids[i % len(order_user_ids)] for i in range(orders)]
+    order_ids = _insert(db, Order, [{'user_id': user_id, 'total_cents': 0} for user_id in order_user_of])
+    _insert(db, OrderItem, [
+        {'order_id': order_id, 'product_id': p, 'quantity': 1, 'price_cents': 100}
+        for order_id in order_ids for p in rng.sample(product_ids, ITEMS_PER_ORDER)])
+    db.session.commit()
+    rebuild_sales_summary()
+    return Context(db, user_ids, cart_user_ids, order_user_ids if orders else user_ids,
+                   product_ids, cart_items)
+
+
+def _products(ctx, n):
+    return [{'price': ctx.rng.uniform(1, 500)} for _ in range(n)]
+
+
+def _search_terms(ctx, n):
+    return [ctx.rng.choice(WORDS)[:ctx.rng.randint(3, 6)] for _ in range(n)]
+
+
+def _cart_item(ctx, n):
+    users = ctx.sample(ctx.cart_user_ids, n)
+    return [(user_id, ctx.rng.choice(ctx.cart_items[user_id])) for user_id in users]
+
+
+def _import_body(ctx, n):
+    return ['\n'.join(json.dumps({'name': f'Imported {i}-{j}', 'price': j + 0.5}) for j in range(IMPORT_ROWS))
+            for i in range(n)]
+
+
+def _deletable_products(ctx, n):
+    from app.models import Product
+    ids = _insert(ctx.db, Product, [
+        {'name': f'Deletable {i}', 'description': '', 'price_cents': 100, 'image_url': ''} for i in range(n)])
+    ctx.db.session.commit()
+    return ids
+
+
+def _image(ctx, size=1200):
+    """A distinct photo-sized JPEG, so every upload is new content."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size * 3 // 4), ctx.rng.randint(20, 80)).convert('RGB').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def _image_uploads(ctx, n):
+    return [(ctx.rng.choice(ctx.product_ids), _image(ctx)) for _ in range(n)]
+
+
+def _image_files(ctx, n):
+    from app import image_store
+    from app.images import VARIANTS
+
+    digest, _, ext = image_store.save(_image(ctx)).partition('.')
+    files = [f'original.{ext}'] + [f'{name}.{variant[2]}' for name, variant in VARIANTS.items()]
+    return [(digest, ctx.rng.choice(files)) for _ in range(n)]
+
+
+def _user_with_item(ctx, n):
+    from app.models import Cart, CartItem
+    user_ids = ctx.new_users(n, items_per_cart=1)
+    rows = ctx.db.session.query(Cart.user_id, CartItem.product_id).join(CartItem).filter(
+        Cart.user_id.in_(user_ids)).all()
+    return [tuple(row) for row in rows]
+
+
+def _streamed(response):
+    # Keeps the entry measuring the streamed path if the query string drifts
+    assert response.is_streamed, 'expected a streamed response'
+    return response
+
+
+ENDPOINTS = [
+    Endpoint('POST /register', 201, lambda ctx, n: [f'{time.perf_counter_ns()}-{i}' for i in range(n)],
+             lambda client, ctx, name: client.post('/register', json={
+                 'username': f'new-{name}', 'email': f'new-{name}@example.com', 'password': PASSWORD})),
+    Endpoint('POST /login', 200, lambda ctx, n: ctx.sample(ctx.user_ids, n),
+             lambda client, ctx, user_id: client.post('/login', json={
+                 'email': f'bench{user_id - ctx.user_ids[0]}@example.com', 'password': PASSWORD})),
+    Endpoint('GET /profile', 200, lambda ctx, n: ctx.sample(ctx.user_ids, n),
+             lambda client, ctx, user_id: client.get('/profile', headers=ctx.headers(user_id))),
+    Endpoint('GET /products', 200, lambda ctx, n: ctx.sample(ctx.product_ids, n),
+             lambda client, ctx, after: client.get('/products', query_string={'after': after})),
+    Endpoint('GET /products?stream=ndjson', 200, lambda ctx, n: ctx.sample(ctx.product_ids, n),
+             lambda client, ctx, after: _streamed(client.get('/products', query_string={
+                 'after': after, 'limit': 500, 'stream': 'ndjson'}))),
+    Endpoint('GET /products?name=', 200, lambda ctx, n: [word[:3] for word in ctx.rng.choices(WORDS, k=n)],
+             lambda client, ctx, prefix: client.get('/products', query_string={'name': prefix})),
+    Endpoint('GET /products/search', 200, _search_terms,
+             lambda client, ctx, q: client.get('/products/search', query_string={'q': q, 'limit': 20})),
+    Endpoint('GET /products/<id>', 200, lambda ctx, n: ctx.sample(ctx.product_ids, n),
+             lambda client, ctx, product_id: client.get(f'/products/{product_id}')),
+    Endpoint('POST /products', 201, _products,
+             lambda client, ctx, body: client.post('/products', headers=ctx.headers(ctx.user_ids[0]), json=dict(
+                 body, name='Benchmark product'))),
+    Endpoint('PUT /products/<id>', 200, lambda ctx, n: ctx.sample(ctx.product_ids, n),
+             lambda client, ctx, product_id: client.put(
+                 f'/products/{product_id}', headers=ctx.headers(ctx.user_ids[0]), json={'price': 9.99})),
+    Endpoint('DELETE /products/<id>', 200, _deletable_products,
+             lambda client, ctx, product_id: client.delete(
+                 f'/products/{product_id}', headers=ctx.headers(ctx.user_ids[0]))),
+    Endpoint('POST /products/<id>/image', 201, _image_uploads,
+             lambda client, ctx, arg: client.post(f'/products/{arg[0]}/image', headers=ctx.headers(ctx.user_ids[0]),
+                                                  data=arg[1], content_type='image/jpeg')),
+    Endpoint('GET /images/<digest>/<filename>', 200, _image_files,
+             lambda client, ctx, arg: client.get(f'/images/{arg[0]}/{arg[1]}')),
+    Endpoint('POST /products/import', 200, _import_body,
+             lambda client, ctx, body: client.post('/products/import', headers=ctx.headers(ctx.user_ids[0]),
+                                                   data=body, content_type='application/x-ndjson')),
+    Endpoint('GET /products/export', 200, lambda ctx, n: [None] * n,
+             lambda client, ctx, _: client.get('/products/export', headers=ctx.headers(ctx.user_ids[0]))),
+    Endpoint('GET /cart', 200, lambda ctx, n: ctx.sample(ctx.cart_user_ids, n),
+             lambda client, ctx, user_id: client.get('/cart', headers=ctx.headers(user_id))),
+    Endpoint('POST /cart/add', 200, lambda ctx, n: ctx.sample(ctx.cart_user_ids, n),
+             lambda client, ctx, user_id: client.post('/cart/add', headers=ctx.headers(user_id), json={
+                 'product_id': ctx.rng.choice(ctx.product_ids), 'quantity': 1})),
+    Endpoint('PATCH /cart', 200, _cart_item,
+             lambda client, ctx, arg: client.patch('/cart', headers=ctx.headers(arg[0]), json={'operations': [
+                 {'op': 'set', 'product_id': arg[1], 'quantity': 2},
+                 {'op': 'add', 'product_id': ctx.rng.choice(ctx.product_ids), 'quantity': 1},
+             ]})),
+    Endpoint('PUT /cart/update/<id>', 200, _cart_item,
+             lambda client, ctx, arg: client.put(
+                 f'/cart/update/{arg[1]}', headers=ctx.headers(arg[0]), json={'quantity': 3})),
+    Endpoint('DELETE /cart/remove/<id>', 200, _user_with_item,
+             lambda client, ctx, arg: client.delete(f'/cart/remove/{arg[1]}', headers=ctx.headers(arg[0]))),
+    Endpoint('POST /orders/create', 201, lambda ctx, n: ctx.new_users(n, items_per_cart=ITEMS_PER_CART),
+             lambda client, ctx, user_id: client.post('/orders/create', headers=ctx.headers(user_id))),
+    Endpoint('GET /orders', 200, lambda ctx, n: ctx.sample(ctx.order_user_ids, n),
+             lambda client, ctx, user_id: client.get('/orders', headers=ctx.headers(user_id))),
+    Endpoint('GET /analytics/sales', 200, lambda ctx, n: [None] * n,
+             lambda client, ctx, _: client.get('/analytics/sales', headers=ctx.headers(ctx.user_ids[0]),
+                                               query_string={'start': '2000-01-01', 'end': '2100-01-01'})),
+    Endpoint('GET /analytics/products', 200, lambda ctx, n: ctx.sample(['revenue', 'units'], n),
+             lambda client, ctx, sort: client.get('/analytics/products', headers=ctx.headers(ctx.user_ids[0]),
+                                                  query_string={'sort': sort, 'limit': 20})),
+    Endpoint('GET /metrics', 200, lambda ctx, n: [None] * n,
+             lambda client, ctx, _: client.get('/metrics')),
+]
+
+
+def measure(app, endpoint, ctx, requests, threads):
+    args = endpoint.prepare(ctx, requests)
+    # Tokens are minted up front so signing them is not timed
+    for arg in args:
+        for user_id in (arg[0] if isinstance(arg, tuple) else arg, ctx.user_ids[0]):
+            if isinstance(user_id, int):
+                ctx.headers(user_id)
+
+    local = threading.local()
+
+    def send(arg):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = endpoint.call(local.client, ctx, arg)
+        response.get_data()  # Streamed bodies are generated here
+        return (time.perf_counter() - start) * 1000, response.status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(send, args))
+        elapsed = time.perf_counter() - start
+
+    samples = [ms for ms, _ in results]
+    unexpected = Counter(status for _, status in results if status != endpoint.status)
+    stats = {
+        'endpoint': endpoint.name,
+        'requests': len(results),
+        'errors': sum(unexpected.values()),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(results) / elapsed, 1),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'max_ms': round(max(samples), 3),
+    }
+    if unexpected:
+        stats['unexpected_statuses'] = {str(status): count for status, count in sorted(unexpected.items())}
+    return stats
+
+
+def compare(results, baseline):
+    """Add the percentage change against a previous run to each result."""
+    previous = {r['endpoint']: r for r in baseline.get('results', [])}
+    for result in results:
+        before = previous.get(result['endpoint'])
+        if not before:
+            continue
+        result['change_pct'] = {
+            key: round((result[key] - before[key]) / before[key] * 100, 1)
+            for key in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms') if before.get(key)
+        }
+    return results
+
+
+def run(app, users, products, carts, orders, requests, threads, names=None):
+    """Seed the app's database and measure every endpoint in ENDPOINTS."""
+    from app import db
+
+    endpoints = [e for e in ENDPOINTS if not names or e.name in names]
+    unknown = set(names or ()) - {e.name for e in ENDPOINTS}
+    if unknown:
+        raise ValueError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+
+    with app.app_context():
+        ctx = seed(db, users, products, max(1, min(carts, users)), orders)
+        results = []
+        for endpoint in endpoints:
+            results.append(measure(app, endpoint, ctx, requests, threads))
+            print(f"{endpoint.name}: p99 {results[-1]['p99_ms']}ms", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--carts', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, help='bcrypt work factor; defaults to BCRYPT_LOG_ROUNDS')
+    parser.add_argument('--endpoints', help='Comma separated endpoint names to run')
+    parser.add_argument('--baseline', help='JSON output of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{tmp}/endpoints.db'
+        os.environ['IMAGE_DIR'] = os.path.join(tmp, 'images')
+        # One client issues every request; limits would only measure 429s
+        os.environ['RATELIMIT_ENABLED'] = '0'
+        from app import create_app, db, hasher
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+        if args.rounds:
+            hasher.configure(rounds=args.rounds)
+        names = [n.strip() for n in args.endpoints.split(',')] if args.endpoints else None
+        results = run(app, args.users, args.products, args.carts, args.orders, args.requests, args.threads, names)
+        hasher.shutdown()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    print(json.dumps({
+        'benchmark': 'endpoints',
+        'users': args.users,
+        'products': args.products,
+        'carts': args.carts,
+        'orders': args.orders,
+        'requests': args.requests,
+        'threads': args.threads,
+        'bcrypt_rounds': hasher.rounds,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
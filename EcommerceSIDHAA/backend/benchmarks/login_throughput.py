@@ -0,0 +1,63 @@
+"""Measure /login throughput at several password hashing pool sizes.
+
+Run from the backend directory:
+
+    python -m benchmarks.login_throughput --pool-sizes 0,1,2,4 --threads 8
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from app import create_app, db, hasher
+from app.models import User
+
+app = create_app()
+
+
+def run(pool_size, rounds, threads, logins):
+    hasher.configure(rounds=rounds, workers=pool_size)
+    credentials = json.dumps({'email': 'bench@example.com', 'password': 'bench-password'})
+
+    def login(_):
+        response = app.test_client().post('/login', data=credentials, content_type='application/json')
+        assert response.status_code == 200, response.status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(login, range(threads)))  # warm up worker processes
+        start = time.perf_counter()
+        list(pool.map(login, range(logins)))
+        elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    return {'pool_size': pool_size, 'logins': logins, 'seconds': round(elapsed, 3),
+            'logins_per_sec': round(logins / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pool-sizes', default='0,1,2,4')
+    parser.add_argument('--rounds', type=int, default=app.config['BCRYPT_LOG_ROUNDS'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=64)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        hasher.configure(rounds=args.rounds, workers=0)
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+
+    results = [run(int(size), args.rounds, args.threads, args.logins)
+               for size in args.pool_sizes.split(',')]
+    print(json.dumps({'benchmark': 'login_throughput', 'rounds': args.rounds,
+                      'threads': args.threads, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Measure the per-request cost of rate limiting in microseconds.
+
+Times the bucket and window stores on their own, then the full
+before_request check for anonymous and token-bearing clients against the
+same check with limiting disabled, and reports the best of several runs:
+
+    python -m benchmarks.rate_limit_overhead --iterations 100000
+"""
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+# Every anonymous check after the first is the hot path: an existing
+# bucket with tokens to spare
+LIMIT_TEXT = '1000000/second'
+
+
+def best_us(func, iterations, repeat):
+    return min(timeit.repeat(func, number=iterations, repeat=repeat)) / iterations * 1e6
+
+
+def measure(app, iterations=100000, repeat=5, clients=10000):
+    """Return {case: microseconds per call}, checking requests to app."""
+    from app.auth import issue_token
+    from app.carts import LocalKV
+    from app.ratelimit import Limit, RateLimiter, SlidingWindows, TokenBuckets
+
+    limit = Limit.parse(LIMIT_TEXT)
+    results = {}
+
+    buckets = TokenBuckets()
+    results['token_bucket'] = best_us(lambda: buckets.take('ip:127.0.0.1', limit), iterations, repeat)
+    keys = iter([f'ip:10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(clients)] * (
+        iterations * repeat // clients + 1))
+    results['token_bucket_many_clients'] = best_us(
+        lambda: buckets.take(next(keys), limit), iterations, repeat)
+
+    windows = SlidingWindows(LocalKV())
+    results['sliding_window_local_kv'] = best_us(
+        lambda: windows.take('ip:127.0.0.1', limit), iterations // 10, repeat)
+
+    enabled_before = app.config['RATELIMIT_ENABLED']
+    limiter = RateLimiter(TokenBuckets(), default=limit, limits={'api.get_products': limit})
+    with app.app_context():
+        token = issue_token(1)
+    cases = {
+        'check_disabled': ({}, False),
+        'check_anonymous': ({}, True),
+        'check_bearer_token': ({'Authorization': f'Bearer {token}'}, True),
+    }
+    for case, (headers, enabled) in cases.items():
+        app.config['RATELIMIT_ENABLED'] = enabled
+        with app.test_request_context('/products', headers=headers):
+            assert limiter.check() is None
+            results[case] = best_us(limiter.check, iterations, repeat)
+    app.config['RATELIMIT_ENABLED'] = enabled_before
+    return {case: round(us, 3) for case, us in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-us', type=float, default=20.0,
+                        help='Fail if an anonymous check costs more than this')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    results = measure(create_app(), args.iterations, args.repeat)
+    print(json.dumps({'benchmark': 'rate_limit_overhead', 'iterations': args.iterations,
+                      'microseconds_per_call': results}, indent=2))
+    overhead = results['check_anonymous'] - results['check_disabled']
+    if overhead > args.budget_us:
+        raise SystemExit(f'Rate limiting adds {overhead:.2f}us per request, budget is {args.budget_us}us')
+
+
+if __name__ == '__main__':
+    main()
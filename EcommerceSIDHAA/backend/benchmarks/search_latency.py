@@ -0,0 +1,99 @@
+"""Measure /products/search latency against a large synthetic catalog.
+
+Seeds a temporary file-backed SQLite database, then times ranked prefix
+searches through the test client and reports percentiles as JSON:
+
+    python -m benchmarks.search_latency --products 1000000 --queries 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+SYLLABLES = ('ka lo mi ne ru sa ti vo ze ba de fi go hu ja pe qi ro su to an el or ix um').split()
+
+
+def vocabulary(size=20000, seed=1):
+    """Synthetic brand/model-like words, so term selectivity resembles a real catalog."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+WORDS = vocabulary()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(db, Product, count, batch_size=20000):
+    rng = random.Random(42)
+    table = Product.__table__
+    for start in range(0, count, batch_size):
+        rows = [{
+            'name': ' '.join(rng.choices(WORDS, k=3)),
+            'description': ' '.join(rng.choices(WORDS, k=20)),
+            'price_cents': rng.randint(100, 50000),
+            'image_url': '',
+        } for _ in range(min(batch_size, count - start))]
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+        print(f'seeded {start + len(rows)}/{count}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--target-p99-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{tmp}/search.db'
+        os.environ['RATELIMIT_ENABLED'] = '0'
+        from app import create_app, db
+        from app.models import Product
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            seed(db, Product, args.products)
+            db.session.execute(db.text("INSERT INTO product_fts(product_fts) VALUES ('optimize')"))
+            db.session.commit()
+
+        client = app.test_client()
+        rng = random.Random(7)
+        samples = []
+        for _ in range(args.queries):
+            terms = rng.sample(WORDS, k=rng.choice((1, 2)))
+            # Mix whole words with typed-so-far prefixes
+            q = ' '.join(t[:rng.randint(3, len(t))] for t in terms)
+            start = time.perf_counter()
+            response = client.get('/products/search', query_string={'q': q, 'limit': args.limit})
+            samples.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+
+        p99 = percentile(samples, 99)
+        print(json.dumps({
+            'benchmark': 'search_latency',
+            'products': args.products,
+            'queries': args.queries,
+            'p50_ms': round(percentile(samples, 50), 3),
+            'p95_ms': round(percentile(samples, 95), 3),
+            'p99_ms': round(p99, 3),
+            'target_p99_ms': args.target_p99_ms,
+            'within_target': p99 <= args.target_p99_ms,
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
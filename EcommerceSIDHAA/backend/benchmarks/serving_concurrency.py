@@ -0,0 +1,203 @@
+"""Compare threaded and gevent gunicorn workers under many concurrent clients.
+
+Seeds a temporary file-backed SQLite database, then starts gunicorn with
+each worker class in turn and drives it over HTTP from --clients
+keep-alive connections. The request mix is catalog reads, cart and order
+reads, and logins, which wait on the password hashing pool. Reports
+throughput and latency percentiles per worker class as JSON:
+
+    python -m benchmarks.serving_concurrency --clients 64 --requests 2000
+
+gevent must be installed for the gevent run.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from benchmarks.endpoints import PASSWORD, seed
+from benchmarks.search_latency import WORDS, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent'},
+}
+
+# (route, weight, request builder); builders return (method, path, body, headers)
+MIX = [
+    ('GET /products/<id>', 30, lambda ctx, rng: ('GET', f'/products/{rng.choice(ctx.product_ids)}', None, {})),
+    ('GET /products', 15, lambda ctx, rng: (
+        'GET', f'/products?after={rng.choice(ctx.product_ids)}&limit=20', None, {})),
+    ('GET /products/search', 15, lambda ctx, rng: (
+        'GET', f'/products/search?q={rng.choice(WORDS)[:4]}&limit=20', None, {})),
+    ('GET /cart', 15, lambda ctx, rng: ('GET', '/cart', None, ctx.headers(rng.choice(ctx.cart_user_ids)))),
+    ('GET /orders', 15, lambda ctx, rng: ('GET', '/orders', None, ctx.headers(rng.choice(ctx.order_user_ids)))),
+    ('POST /login', 10, lambda ctx, rng: ('POST', '/login', json.dumps({
+        'email': f'bench{rng.choice(ctx.user_ids) - ctx.user_ids[0]}@example.com', 'password': PASSWORD}),
+        {'Content-Type': 'application/json'})),
+]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_serving(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {server.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/metrics')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def drive(port, requests, clients):
+    """Send requests from `clients` keep-alive connections.
+
+    Every connection is opened and used once before the clock starts, so
+    connection setup is not measured. Returns ([(route, ms, status)], seconds).
+    """
+    pending = iter(requests)
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+    results = []
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        conn.request('GET', '/metrics')
+        conn.getresponse().read()
+        ready.wait()
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                break
+            route, method, path, body, headers = request
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                status = 0
+            results.append((route, (time.perf_counter() - start) * 1000, status))
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def run_mode(mode, env, requests, clients):
+    port = _free_port()
+    env = dict(env, **MODES[mode], GUNICORN_BIND=f'127.0.0.1:{port}')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until_serving(port, server)
+        drive(port, requests[:clients], clients)  # Warm up worker state
+        results, elapsed = drive(port, requests, clients)
+    finally:
+        server.terminate()
+        server.wait()
+
+    samples = [ms for _, ms, _ in results]
+    statuses = Counter(status for _, _, status in results)
+    by_route = {}
+    for route, ms, _ in results:
+        by_route.setdefault(route, []).append(ms)
+    return {
+        'worker_class': mode,
+        'requests': len(results),
+        'errors': sum(count for status, count in statuses.items() if not 200 <= status < 300),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(results) / elapsed, 1),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'max_ms': round(max(samples), 3),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'routes': {route: {'p50_ms': round(percentile(ms, 50), 3), 'p99_ms': round(percentile(ms, 99), 3)}
+                   for route, ms in sorted(by_route.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes per run')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gthread worker')
+    parser.add_argument('--connections', type=int, default=1000, help='Greenlets per gevent worker')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt work factor')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL=f'sqlite:///{tmp}/serving.db',
+                   LOG_DIR=os.path.join(tmp, 'logs'),
+                   BCRYPT_LOG_ROUNDS=str(args.rounds),
+                   WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_WORKER_CONNECTIONS=str(args.connections),
+                   GUNICORN_PRELOAD='true',
+                   RATELIMIT_ENABLED='0')
+        os.environ.update(env)
+        from app import create_app, db
+
+        app = create_app()
+        rng = random.Random(3)
+        with app.app_context():
+            db.create_all()
+            ctx = seed(db, args.users, args.products, carts=args.users // 2, orders=args.users * 2)
+            requests = [(route,) + build(ctx, rng) for route, _, build in
+                        rng.choices(MIX, [weight for _, weight, _ in MIX], k=args.requests)]
+
+        results = []
+        for mode in args.modes.split(','):
+            results.append(run_mode(mode, env, requests, args.clients))
+            print(f"{mode}: {results[-1]['requests_per_sec']} req/s, p99 {results[-1]['p99_ms']}ms",
+                  file=sys.stderr)
+
+    print(json.dumps({
+        'benchmark': 'serving_concurrency',
+        'clients': args.clients,
+        'workers': args.workers,
+        'threads': args.threads,
+        'connections': args.connections,
+        'bcrypt_rounds': args.rounds,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""gunicorn settings, overridable from the environment.
+
+    flask db upgrade                       # once per deploy, before starting
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+GUNICORN_WORKER_CLASS=gevent (requires the gevent package) serves each
+request in a greenlet instead of a thread, so one worker keeps up to
+GUNICORN_WORKER_CONNECTIONS requests in flight while they wait on the
+database, Redis, the password hashing pool or slow clients. Routes are
+unchanged; blocking calls are made cooperative by monkey patching.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Requests block on SQLite, Redis and the bcrypt pool rather than on Python
+# code, so a few processes with several threads each go further than one
+# process per request
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or ('gthread' if threads > 1 else 'sync')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+if os.environ.get('CART_BACKEND') == 'memory' and workers > 1:
+    # Each worker would keep and write back its own copy of every cart
+    raise RuntimeError('CART_BACKEND=memory requires WEB_CONCURRENCY=1; use redis to share carts')
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, so the locks, sockets and threads
+    # it creates at startup are cooperative too
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        pass
+    else:
+        patch_psycopg()
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound slow leaks; the jitter keeps them
+# from restarting all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# The app writes its own JSON access log
+accesslog = None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with workers
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
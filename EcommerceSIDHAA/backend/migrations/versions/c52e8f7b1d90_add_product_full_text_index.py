@@ -0,0 +1,49 @@
+"""Add product full-text index
+
+Revision ID: c52e8f7b1d90
+Revises: a91d5c03e6b4
+Create Date: 2025-08-18 11:27:05.403918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e8f7b1d90'
+down_revision = 'a91d5c03e6b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite FTS5 only; other databases fall back to substring search
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE product_fts USING fts5("
+        "name, description, content='product', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    op.execute(
+        "CREATE TRIGGER product_fts_ai AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END")
+    op.execute(
+        "CREATE TRIGGER product_fts_ad AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END")
+    op.execute(
+        "CREATE TRIGGER product_fts_au AFTER UPDATE OF name, description ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END")
+    # Index the rows that already exist
+    op.execute("INSERT INTO product_fts(product_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS product_fts_au')
+    op.execute('DROP TRIGGER IF EXISTS product_fts_ad')
+    op.execute('DROP TRIGGER IF EXISTS product_fts_ai')
+    op.execute('DROP TABLE IF EXISTS product_fts')
@@ -0,0 +1,74 @@
+"""Store money as integer cents
+
+Revision ID: e81b4f6d2a37
+Revises: 6000c8b8a170
+Create Date: 2025-08-29 10:48:12.904561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b4f6d2a37'
+down_revision = '6000c8b8a170'
+branch_labels = None
+depends_on = None
+
+# (table, float column in major units, integer column in cents, indexed)
+MONEY_COLUMNS = [
+    ('product', 'price', 'price_cents', True),
+    ('order', 'total_price', 'total_cents', False),
+    ('order_item', 'price', 'price_cents', False),
+    ('daily_sales', 'revenue', 'revenue_cents', False),
+    ('product_sales', 'revenue', 'revenue_cents', True),
+]
+
+# Recreating the product table on SQLite drops its triggers; these are the
+# ones from c52e8f7b1d90 that keep product_fts in step
+FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+
+def _replace_column(table, old, new, new_type, convert, indexed):
+    """Add new, fill it from old with convert(old column), then drop old."""
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        batch_op.add_column(sa.Column(new, new_type, nullable=True))
+    op.execute(sa.table(table, sa.column(old), sa.column(new)).update().values(
+        {new: convert(sa.column(old))}))
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        batch_op.alter_column(new, existing_type=new_type, nullable=False)
+        if indexed:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_{old}'))
+            batch_op.create_index(batch_op.f(f'ix_{table}_{new}'), [new], unique=False)
+        batch_op.drop_column(old)
+
+
+def _restore_fts_triggers():
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    # Rounding the scaled float recovers the intended cents: 19.99 is
+    # stored as 19.989999..., and 1998.99... rounds to 1999
+    for table, units, cents, indexed in MONEY_COLUMNS:
+        _replace_column(table, units, cents, sa.Integer(),
+                        lambda column: sa.cast(sa.func.round(column * 100), sa.Integer), indexed)
+    _restore_fts_triggers()
+
+
+def downgrade():
+    for table, units, cents, indexed in reversed(MONEY_COLUMNS):
+        _replace_column(table, cents, units, sa.Float(), lambda column: column / 100.0, indexed)
+    _restore_fts_triggers()
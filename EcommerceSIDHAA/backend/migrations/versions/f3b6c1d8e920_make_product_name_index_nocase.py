@@ -0,0 +1,30 @@
+"""Make the product name index NOCASE
+
+Revision ID: f3b6c1d8e920
+Revises: 7cd76f7a0fa0
+Create Date: 2025-09-02 09:31:47.215663
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b6c1d8e920'
+down_revision = '7cd76f7a0fa0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The name filter is a prefix LIKE, which SQLite serves from an index
+    # only if it is NOCASE; other databases get no name index
+    op.drop_index('ix_product_name', table_name='product')
+    if op.get_bind().dialect.name == 'sqlite':
+        op.create_index('ix_product_name', 'product', [sa.text('name COLLATE NOCASE')], unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.drop_index('ix_product_name', table_name='product')
+    op.create_index('ix_product_name', 'product', ['name'], unique=False)
@@ -1,7 +1,49 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+import io
 import json
-from app import app, db
-from app.models import User, Product
+import logging
+from flask import has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import create_engine, event, func, text
+
+# Tests drop every table; never let them near a configured database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['LOG_DIR'] = tempfile.mkdtemp()
+os.environ['IMAGE_DIR'] = tempfile.mkdtemp()
+os.environ['IMAGE_WORKERS'] = '0'
+# Every test request comes from one address; test_rate_limits turns it on
+os.environ['RATELIMIT_ENABLED'] = '0'
+
+from app import create_app, db, hasher, image_store, product_cache
+from app.auth import issue_token, user_cache
+from app.carts import KVCartStore, LocalKV
+from app.log import LogWriter
+from app.config import configure_sqlite, engine_options
+from app.passwords import PasswordHasher
+from benchmarks import checkout_contention, cold_start, endpoints, rate_limit_overhead
+from app.cache import LRUCache
+from app.models import User, Product, Cart, CartItem, Order, OrderItem
+from app.money import to_cents
+from app.ratelimit import Limit, SlidingWindows, TokenBuckets
+
+app = create_app()
+log_writer = app.extensions['log_writer']
+
+# Cumulative `python -X importtime` cost of `import app`
+IMPORT_BUDGET_MS = 50
+# Microseconds rate limiting may add to an anonymous request
+RATE_LIMIT_BUDGET_US = 50
 
 class ApiTestCase(unittest.TestCase):
     def setUp(self):
@@ -9,9 +51,30 @@ class ApiTestCase(unittest.TestCase):
         app.config['TESTING'] = True
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.client = app.test_client()
+        product_cache.clear()
+        user_cache.clear()
         with app.app_context():
             db.create_all()
 
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """Fail if the block issues more than `budget` SQL statements."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        self.assertLessEqual(
+            len(statements), budget,
+            f'{len(statements)} queries issued, budget is {budget}:\n' + '\n'.join(statements))
+
     def tearDown(self):
         """Tear down the database."""
         with app.app_context():
@@ -27,12 +90,12 @@ class ApiTestCase(unittest.TestCase):
             db.session.commit()
             product_id = p.id
 
-        # Attempt to delete the product without the x-user-id header
+        # Attempt to delete the product without an auth token
         response = self.client.delete(f'/products/{product_id}')
 
         # Check that the response is 401 Unauthorized
         self.assertEqual(response.status_code, 401)
-        self.assertIn('User ID is missing!', response.get_data(as_text=True))
+        self.assertIn('Token is missing!', response.get_data(as_text=True))
 
     def test_create_product_unauthorized(self):
         """Test that creating a product without auth fails."""
@@ -40,7 +103,7 @@ class ApiTestCase(unittest.TestCase):
                                     data=json.dumps({'name': 'New Product', 'price': 20.0}),
                                     content_type='application/json')
         self.assertEqual(response.status_code, 401)
-        self.assertIn('User ID is missing!', response.get_data(as_text=True))
+        self.assertIn('Token is missing!', response.get_data(as_text=True))
 
     def test_update_product_unauthorized(self):
         """Test that updating a product without auth fails."""
@@ -55,7 +118,1026 @@ class ApiTestCase(unittest.TestCase):
                                    data=json.dumps({'name': 'Updated Name'}),
                                    content_type='application/json')
         self.assertEqual(response.status_code, 401)
-        self.assertIn('User ID is missing!', response.get_data(as_text=True))
+        self.assertIn('Token is missing!', response.get_data(as_text=True))
+
+    def _auth_headers(self, user_id):
+        with app.app_context():
+            return {'Authorization': f'Bearer {issue_token(user_id)}'}
+
+    def _create_admin(self):
+        with app.app_context():
+            user = User(username='admin', email='admin@example.com')
+            db.session.add(user)
+            db.session.commit()
+            return self._auth_headers(user.id)
+
+    def _create_products(self, count):
+        with app.app_context():
+            for i in range(count):
+                db.session.add(Product(name=f'Product {i}', description=f'Description {i}', price=float(i)))
+            db.session.commit()
+
+    def test_get_products_keyset_pagination(self):
+        """Test that products are returned in pages linked by a cursor."""
+        self._create_products(5)
+
+        response = self.client.get('/products?limit=2')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([p['id'] for p in data['products']], [1, 2])
+        self.assertEqual(data['next_cursor'], 2)
+
+        data = self.client.get(f"/products?limit=2&after={data['next_cursor']}").get_json()
+        self.assertEqual([p['id'] for p in data['products']], [3, 4])
+
+        data = self.client.get(f"/products?limit=2&after={data['next_cursor']}").get_json()
+        self.assertEqual([p['id'] for p in data['products']], [5])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_products_filters(self):
+        """Test the price range and name filters."""
+        self._create_products(5)
+        data = self.client.get('/products?min_price=1&max_price=3').get_json()
+        self.assertEqual([p['price'] for p in data['products']], [1.0, 2.0, 3.0])
+
+        data = self.client.get('/products?name=product 4').get_json()
+        self.assertEqual([p['name'] for p in data['products']], ['Product 4'])
+        # Names are matched by prefix, with wildcards taken literally
+        self.assertEqual(len(self.client.get('/products?name=PROD').get_json()['products']), 5)
+        self.assertEqual(self.client.get('/products?name=duct').get_json()['products'], [])
+        self.assertEqual(self.client.get('/products?name=Product_').get_json()['products'], [])
+
+    def test_money_is_exact(self):
+        """Test that prices are kept in cents and totals do not drift."""
+        self.assertEqual([to_cents(v) for v in (19.99, '19.99', 0.1, 12, '0.005')], [1999, 1999, 10, 1200, 1])
+        for bad in ('abc', float('nan'), None, True):
+            with self.assertRaises(ValueError):
+                to_cents(bad)
+
+        headers = self._create_admin()
+        for price in (0.1, 0.2):
+            self.client.post('/products', data=json.dumps({'name': f'Item {price}', 'price': price}),
+                             content_type='application/json', headers=headers)
+        for bad in ('free', -0.01):
+            response = self.client.post('/products', data=json.dumps({'name': 'Bad', 'price': bad}),
+                                        content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.put('/products/1', data=json.dumps({'price': -1}),
+                                   content_type='application/json', headers=headers)
+        self.assertEqual(response.get_json(), {'message': 'Invalid price'})
+        with app.app_context():
+            self.assertEqual([p.price_cents for p in Product.query.order_by(Product.id)], [10, 20])
+
+        for product_id in (1, 2):
+            self.client.post('/cart/add', data=json.dumps({'product_id': product_id, 'quantity': 1}),
+                             content_type='application/json', headers=headers)
+        self.assertEqual(self.client.get('/cart', headers=headers).get_json()['total'], 0.3)
+        self.client.post('/orders/create', headers=headers)
+        order = self.client.get('/orders', headers=headers).get_json()['orders'][0]
+        self.assertEqual(order['total_price'], 0.3)
+        self.assertEqual([item['price'] for item in order['items']], [0.1, 0.2])
+
+    def test_stock_must_be_a_count(self):
+        """Test that stock is a non-negative integer or null when products are written."""
+        headers = self._create_admin()
+        for stock in (None, 0, 7):
+            response = self.client.post('/products', data=json.dumps({'name': 'Lamp', 'price': 5, 'stock': stock}),
+                                        content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 201)
+        for bad in ('lots', -5, 2.5, True, '3', 2 ** 63):
+            response = self.client.post('/products', data=json.dumps({'name': 'Bad', 'price': 5, 'stock': bad}),
+                                        content_type='application/json', headers=headers)
+            self.assertEqual(response.get_json(), {'message': 'Invalid stock'})
+            response = self.client.put('/products/3', data=json.dumps({'name': 'Renamed', 'stock': bad}),
+                                       content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+        self.client.put('/products/3', data=json.dumps({'stock': None}),
+                        content_type='application/json', headers=headers)
+        with app.app_context():
+            self.assertEqual([(p.name, p.stock) for p in Product.query.order_by(Product.id)],
+                             [('Lamp', None), ('Lamp', 0), ('Lamp', None)])
+
+    def test_concurrent_product_writes_conflict(self):
+        """Test that a write losing a race with another one on the same product returns 409."""
+        headers = self._create_admin()
+        self._create_products(1)
+        # A product another request changed or deleted since it was read
+        # matches no row; the trigger makes the write miss the same way
+        with app.app_context():
+            for action in ('UPDATE', 'DELETE'):
+                db.session.execute(text(f'CREATE TEMP TRIGGER lose_{action} BEFORE {action} ON product '
+                                        'BEGIN SELECT RAISE(IGNORE); END'))
+            db.session.commit()
+        try:
+            response = self.client.put('/products/1', data=json.dumps({'name': 'Renamed'}),
+                                       content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(self.client.delete('/products/1', headers=headers).status_code, 409)
+        finally:
+            with app.app_context():
+                for action in ('UPDATE', 'DELETE'):
+                    db.session.execute(text(f'DROP TRIGGER lose_{action}'))
+                db.session.commit()
+
+        response = self.client.put('/products/1', data=json.dumps({'name': 'Renamed'}),
+                                   content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/products/1').get_json()['product']['name'], 'Renamed')
+
+    def test_get_products_field_projection(self):
+        """Test that only the requested fields are returned."""
+        self._create_products(1)
+        data = self.client.get('/products?fields=name,price').get_json()
+        self.assertEqual(data['products'], [{'id': 1, 'name': 'Product 0', 'price': 0.0}])
+
+        response = self.client.get('/products?fields=name,password_hash')
+        self.assertEqual(response.status_code, 400)
+
+    def _create_user_with_history(self, orders=3, items_per_order=3):
+        """Create a user with a populated cart and order history."""
+        with app.app_context():
+            user = User(username='shopper', email='shopper@example.com')
+            db.session.add(user)
+            products = [Product(name=f'Product {i}', description='', price=float(i + 1))
+                        for i in range(items_per_order)]
+            db.session.add_all(products)
+            db.session.flush()
+
+            cart = Cart(user_id=user.id)
+            db.session.add(cart)
+            db.session.flush()
+            for product in products:
+                db.session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=2))
+
+            for _ in range(orders):
+                order = Order(user_id=user.id, total_price=0)
+                db.session.add(order)
+                db.session.flush()
+                for product in products:
+                    db.session.add(OrderItem(order_id=order.id, product_id=product.id,
+                                             quantity=1, price=product.price))
+            db.session.commit()
+            return user.id
+
+    def test_get_orders_query_budget(self):
+        """Test that listing orders does not issue a query per order or item."""
+        user_id = self._create_user_with_history(orders=5, items_per_order=4)
+        with self.assertQueryBudget(2):
+            response = self.client.get('/orders', headers=self._auth_headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        orders = response.get_json()['orders']
+        self.assertEqual(len(orders), 5)
+        self.assertEqual([i['name'] for i in orders[0]['items']],
+                         ['Product 0', 'Product 1', 'Product 2', 'Product 3'])
+
+    def test_get_cart_query_budget(self):
+        """Test that fetching the cart does not issue a query per item."""
+        user_id = self._create_user_with_history(orders=0, items_per_order=6)
+        with self.assertQueryBudget(2):
+            response = self.client.get('/cart', headers=self._auth_headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data['items']), 6)
+        self.assertEqual(data['total'], 2 * sum(range(1, 7)))
+
+    def test_product_cache_hit_and_invalidation(self):
+        """Test that product reads are cached and writes invalidate them."""
+        self._create_products(1)
+        headers = self._create_admin()
+
+        self.client.get('/products/1')
+        self.client.get('/products')
+        with self.assertQueryBudget(0):
+            self.assertEqual(self.client.get('/products/1').get_json()['product']['name'], 'Product 0')
+            self.assertEqual(len(self.client.get('/products').get_json()['products']), 1)
+
+        self.client.put('/products/1', data=json.dumps({'name': 'Renamed'}),
+                        content_type='application/json', headers=headers)
+        self.assertEqual(self.client.get('/products/1').get_json()['product']['name'], 'Renamed')
+        self.assertEqual(self.client.get('/products').get_json()['products'][0]['name'], 'Renamed')
+
+        # A read that built its entry before a concurrent update committed
+        # must not store it over the update
+        key = product_cache.product_key(1)
+        product_cache.backend.delete(key)
+        product_cache.get_or_build(key, lambda: (
+            self.client.put('/products/1', data=json.dumps({'name': 'Raced'}),
+                            content_type='application/json', headers=headers),
+            ('1-2', b'{"product": {"name": "Renamed"}}'))[1])
+        self.assertEqual(self.client.get('/products/1').get_json()['product']['name'], 'Raced')
+
+        self.client.delete('/products/1', headers=headers)
+        self.assertEqual(self.client.get('/products/1').status_code, 404)
+        self.assertEqual(self.client.get('/products').get_json()['products'], [])
+
+    def test_lru_cache_bounds_and_counters(self):
+        """Test that the LRU cache evicts the least recently used entries."""
+        cache = LRUCache(max_size=2, ttl=0)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.get('a')
+        cache.set('c', b'3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'evictions': 1, 'size': 2, 'max_size': 2})
+
+    def test_product_etag_conditional_get(self):
+        """Test that catalog responses carry ETags and honour If-None-Match."""
+        self._create_products(1)
+        headers = self._create_admin()
+
+        for url in ('/products/1', '/products'):
+            response = self.client.get(url)
+            etag = response.headers['ETag']
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+
+        old_etag = self.client.get('/products/1').headers['ETag']
+        self.assertEqual(old_etag, '"1-1"')
+        self.client.put('/products/1', data=json.dumps({'price': 5.0}),
+                        content_type='application/json', headers=headers)
+        response = self.client.get('/products/1', headers={'If-None-Match': old_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"1-2"')
+
+    def test_sqlite_file_engine_tuning(self):
+        """Test that file-backed SQLite gets a pool and WAL pragmas."""
+        with tempfile.TemporaryDirectory() as tmp:
+            config = dict(app.config, SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp}/app.db')
+            options = engine_options(config)
+            self.assertEqual(options['pool_size'], app.config['DB_POOL_SIZE'])
+            self.assertTrue(options['pool_pre_ping'])
+            with mock.patch('app.config._is_green', return_value=True):
+                green = engine_options(config)
+            self.assertEqual((green['pool_size'], green['max_overflow']), (1, 0))  # One connection per worker
+
+            engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **options)
+            configure_sqlite(engine, config)
+            with engine.connect() as conn:
+                self.assertEqual(conn.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+                self.assertEqual(conn.execute(text('PRAGMA busy_timeout')).scalar(),
+                                 app.config['SQLITE_BUSY_TIMEOUT'])
+            engine.dispose()
+
+        self.assertEqual(engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI='sqlite://')), {})
+
+    def test_import_time_budget(self):
+        """Test that importing the package is cheap and app startup skips Alembic."""
+        times = cold_start.import_times('import app')
+        self.assertLess(times['app'][0] / 1000, IMPORT_BUDGET_MS)
+        for module in ('flask', 'sqlalchemy', 'flask_migrate', 'multiprocessing'):
+            self.assertNotIn(module, times)
+
+        times = cold_start.import_times('import app; app.create_app()')
+        self.assertIn('flask_sqlalchemy', times)
+        self.assertNotIn('alembic', times)
+
+    def test_migrations_build_the_model_schema(self):
+        """Test that migrations alone create the schema the models expect."""
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp}/app.db', FLASK_APP='app')
+            for command in ('upgrade', 'check'):
+                result = subprocess.run([sys.executable, '-m', 'flask', 'db', command], env=env,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        capture_output=True, text=True)
+                self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_login_rehashes_on_cost_change(self):
+        """Test that a login upgrades hashes made with an old work factor."""
+        self.client.post('/register', data=json.dumps(
+            {'username': 'alice', 'email': 'alice@example.com', 'password': 'secret'}),
+            content_type='application/json')
+        credentials = json.dumps({'email': 'alice@example.com', 'password': 'secret'})
+
+        hasher.configure(rounds=5)
+        try:
+            response = self.client.post('/login', data=credentials, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            with app.app_context():
+                self.assertTrue(User.query.one().password_hash.startswith('$2b$05$'))
+        finally:
+            hasher.configure(rounds=4)
+
+        response = self.client.post('/login', data=json.dumps(
+            {'email': 'alice@example.com', 'password': 'wrong'}), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_hasher_process_pool(self):
+        """Test hashing through worker processes."""
+        pool_hasher = PasswordHasher(rounds=4, workers=1)
+        try:
+            password_hash = pool_hasher.hash('secret')
+            self.assertTrue(pool_hasher.check(password_hash, 'secret'))
+            self.assertFalse(pool_hasher.check(password_hash, 'other'))
+            self.assertFalse(pool_hasher.needs_rehash(password_hash))
+        finally:
+            pool_hasher.shutdown()
+
+    def test_create_order_is_single_transaction(self):
+        """Test that placing an order copies the cart and empties it in one commit."""
+        user_id = self._create_user_with_history(orders=0, items_per_order=4)
+        headers = self._auth_headers(user_id)
+
+        commits = []
+
+        def on_commit(conn):
+            commits.append(conn)
+
+        with app.app_context():
+            event.listen(db.engine, 'commit', on_commit)
+        try:
+            # One conditional stock UPDATE per product, the rest is constant,
+            # including the two sales summary upserts
+            with self.assertQueryBudget(10 + 4):
+                response = self.client.post('/orders/create', headers=headers)
+        finally:
+            with app.app_context():
+                event.remove(db.engine, 'commit', on_commit)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(commits), 1)
+
+        order = self.client.get('/orders', headers=headers).get_json()['orders'][0]
+        self.assertEqual(order['total_price'], 2 * (1 + 2 + 3 + 4))
+        self.assertEqual([(i['name'], i['quantity'], i['price']) for i in order['items']],
+                         [(f'Product {i}', 2, float(i + 1)) for i in range(4)])
+        self.assertEqual(self.client.get('/cart', headers=headers).get_json()['items'], [])
+
+        response = self.client.post('/orders/create', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_sales_analytics(self):
+        """Test that checkouts update the sales summaries and a rebuild agrees."""
+        user_id = self._create_user_with_history(orders=0, items_per_order=3)
+        headers = self._auth_headers(user_id)
+        self.assertEqual(self.client.post('/orders/create', headers=headers).status_code, 201)
+        self.client.post('/cart/add', headers=headers, data=json.dumps({'product_id': 3, 'quantity': 1}),
+                         content_type='application/json')
+        self.assertEqual(self.client.post('/orders/create', headers=headers).status_code, 201)
+
+        def snapshot():
+            sales = self.client.get('/analytics/sales', headers=headers).get_json()
+            products = self.client.get('/analytics/products?sort=units&limit=2', headers=headers).get_json()
+            return sales, products
+
+        sales, products = snapshot()
+        self.assertEqual(len(sales['days']), 1)
+        self.assertEqual(sales['totals'], {'orders': 2, 'units': 7, 'revenue': 15.0,
+                                           'average_order_value': 7.5})
+        self.assertEqual([(p['product_id'], p['name'], p['orders'], p['units'], p['revenue'])
+                          for p in products['products']],
+                         [(3, 'Product 2', 2, 3, 9.0), (1, 'Product 0', 1, 2, 2.0)])
+
+        result = app.test_cli_runner().invoke(args=['rebuild-sales-summary', '--batch-size', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(json.loads(result.stdout), {'orders': 2})
+        self.assertEqual(snapshot(), (sales, products))
+
+        day = sales['days'][0]['day']
+        response = self.client.get(f'/analytics/sales?start={day}&end={day}', headers=headers)
+        self.assertEqual(response.get_json()['totals']['orders'], 2)
+        response = self.client.get('/analytics/sales?start=1999-12-31&end=2000-01-01', headers=headers)
+        self.assertEqual(response.get_json(), {'days': [], 'totals': {
+            'orders': 0, 'units': 0, 'revenue': 0, 'average_order_value': 0}})
+        self.assertEqual(self.client.get('/analytics/sales?start=yesterday', headers=headers).status_code, 400)
+        self.assertEqual(self.client.get('/analytics/products?sort=name', headers=headers).status_code, 400)
+
+    def test_create_order_rejects_insufficient_stock(self):
+        """Test that checkout fails atomically when a product is short on stock."""
+        user_id = self._create_user_with_history(orders=0, items_per_order=2)
+        headers = self._auth_headers(user_id)
+        with app.app_context():
+            db.session.get(Product, 1).stock = 10
+            db.session.get(Product, 2).stock = 1
+            db.session.commit()
+
+        response = self.client.post('/orders/create', headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['product_id'], 2)
+        with app.app_context():
+            self.assertEqual(db.session.get(Product, 1).stock, 10)
+            self.assertEqual(Order.query.count(), 0)
+        self.assertEqual(len(self.client.get('/cart', headers=headers).get_json()['items']), 2)
+
+        with app.app_context():
+            db.session.get(Product, 2).stock = 2
+            db.session.commit()
+        response = self.client.post('/orders/create', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/products/2').get_json()['product']['stock'], 0)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        """Stress concurrent stock decrements on a shared file-backed database."""
+        with tempfile.TemporaryDirectory() as tmp:
+            stats = checkout_contention.run(f'sqlite:///{tmp}/stress.db', stock=50, threads=8, attempts=20)
+        self.assertEqual(stats['succeeded'], 50)
+        self.assertEqual(stats['final_stock'], 0)
+
+    def test_concurrent_checkouts_of_one_cart(self):
+        """Test that a double-submitted checkout places one order and takes stock once."""
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp}/checkout.db', 'LOG_DIR': tmp})
+            try:
+                with shared.app_context():
+                    db.create_all()
+                    user = User(username='buyer', email='buyer@example.com')
+                    product = Product(name='Lamp', description='', price=5.0, stock=100)
+                    db.session.add_all([user, product])
+                    db.session.flush()
+                    cart = Cart(user_id=user.id)
+                    db.session.add(cart)
+                    db.session.flush()
+                    db.session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=4))
+                    db.session.commit()
+                    headers = {'Authorization': f'Bearer {issue_token(user.id)}'}
+
+                start = threading.Barrier(4)
+
+                def checkout(_):
+                    client = shared.test_client()
+                    start.wait()
+                    return client.post('/orders/create', headers=headers).status_code
+
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    statuses = sorted(pool.map(checkout, range(4)))
+                self.assertEqual(statuses, [201, 400, 400, 400])
+                with shared.app_context():
+                    self.assertEqual(Product.query.one().stock, 96)
+                    self.assertEqual(Order.query.count(), 1)
+                    self.assertEqual(OrderItem.query.one().quantity, 4)
+                    db.engine.dispose()
+            finally:
+                shared.extensions['log_writer'].stop()
+                product_cache.init_app(app)
+
+    def test_endpoint_benchmark_covers_every_route(self):
+        """Smoke-run the endpoint benchmark so it keeps up with the routes."""
+        results = endpoints.run(app, users=4, products=20, carts=2, orders=4, requests=2, threads=1)
+        benchmarked = {r['endpoint'].split('?')[0].replace('<id>', '<int:product_id>') for r in results}
+        routes = {f'{method} {rule.rule}' for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+                  for method in rule.methods - {'HEAD', 'OPTIONS'}}
+        self.assertEqual(routes - benchmarked, set())
+        self.assertEqual([r for r in results if r['errors']], [])
+
+    def test_route_queries_use_indexes(self):
+        """Test that no filtered query issued by a route scans a table."""
+        issued = {}
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                issued.setdefault(statement, parameters[0] if executemany else parameters)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            endpoints.run(app, users=4, products=20, carts=2, orders=4, requests=2, threads=1)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        scans = []
+        with engine.connect() as conn:
+            for statement, parameters in issued.items():
+                # Unfiltered reads such as the export walk the table by design
+                if 'WHERE' not in statement.split():
+                    continue
+                plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+                scans += [f'{row.detail}: {statement}' for row in plan
+                          if row.detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in row.detail
+                          and not row.detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery'))]
+        self.assertGreater(len(issued), 20)
+        self.assertEqual(scans, [])
+
+    def test_product_image_upload(self):
+        """Test that uploads are stored by content hash and served as cacheable variants."""
+        from PIL import Image
+
+        headers = self._create_admin()
+        self._create_products(1)
+        buffer = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (255, 0, 0, 128)).save(buffer, 'PNG')
+        png = buffer.getvalue()
+
+        response = self.client.post('/products/1/image', headers=headers,
+                                    data={'image': (io.BytesIO(png), 'photo.png')})
+        self.assertEqual(response.status_code, 201)
+        images = response.get_json()['images']
+        self.assertEqual(set(images), {'original', 'thumb', 'thumb_webp', 'medium', 'medium_webp'})
+        self.assertTrue(images['original'].endswith('/original.png'))
+        product = self.client.get('/products/1').get_json()['product']
+        self.assertEqual((product['images'], product['image_url']), (images, images['medium']))
+        listing = self.client.get('/products?fields=images').get_json()['products']
+        self.assertEqual(listing, [{'id': 1, 'images': images}])
+
+        # The same bytes map to the same files, even from a raw body
+        response = self.client.post('/products/1/image', headers=headers, data=png, content_type='image/png')
+        self.assertEqual(response.get_json()['images'], images)
+
+        response = self.client.get(images['thumb_webp'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.cache_control.max_age, 365 * 24 * 3600)
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (200, 100))
+        response = self.client.get(images['thumb_webp'], headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        # A variant missing on disk is rendered on first request
+        digest = images['medium'].split('/')[-2]
+        os.remove(image_store.path(digest, 'medium.jpg'))
+        response = self.client.get(images['medium'])
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (800, 400))
+
+        self.assertEqual(self.client.get(f'/images/{digest}/huge.jpg').status_code, 404)
+        self.assertEqual(self.client.get(f'/images/{digest}/original.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/images/..%2F..%2Fetc/original.png').status_code, 404)
+        response = self.client.post('/products/1/image', headers=headers, data=b'not an image',
+                                    content_type='image/png')
+        self.assertEqual(response.status_code, 400)
+        with mock.patch.object(image_store, 'max_bytes', len(png) - 1):
+            response = self.client.post('/products/1/image', headers=headers, data=png, content_type='image/png')
+        self.assertEqual(response.status_code, 413)
+
+    def test_bulk_import_and_export(self):
+        """Test batched CSV import with row errors and streamed export."""
+        headers = self._create_admin()
+        self._create_products(1)
+        feed = ('id,name,description,price,stock\n'
+                '1,Replaced,Updated row,9.5,3\n'
+                ',New A,,1.25,\n'
+                ',,Missing name,2,\n'
+                ',New B,,not-a-price,\n'
+                ',New C,,3,7\n'
+                '99999999999999999999,Too big,,1,\n')
+        response = self.client.post('/products/import?batch_size=2', data=feed,
+                                    content_type='text/csv', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual((report['processed'], report['imported'], report['failed']), (6, 3, 3))
+        self.assertEqual([e['line'] for e in report['errors']], [4, 5, 7])
+        self.assertEqual(report['errors'][2]['error'], 'id is too large')
+
+        # A batch the database rejects is retried row by row
+        with app.app_context():
+            db.session.execute(text("CREATE TEMP TRIGGER reject_bad BEFORE INSERT ON product "
+                                    "WHEN new.name = 'Bad' BEGIN SELECT RAISE(ABORT, 'rejected'); END"))
+            db.session.commit()
+        try:
+            report = self.client.post('/products/import?batch_size=5', data='name,price\nD,1\nBad,1\nE,1\n',
+                                      content_type='text/csv', headers=headers).get_json()
+        finally:
+            with app.app_context():
+                db.session.execute(text('DROP TRIGGER reject_bad'))
+                db.session.commit()
+        self.assertEqual((report['processed'], report['imported'], report['failed']), (3, 2, 1))
+        self.assertEqual(report['errors'][0]['line'], 3)
+        with app.app_context():
+            self.assertEqual(Product.query.filter(Product.name.in_(['D', 'E'])).count(), 2)
+            db.session.execute(text("DELETE FROM product WHERE name IN ('D', 'E')"))
+            db.session.commit()
+
+        response = self.client.get('/products/export?format=jsonl', headers=headers)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([(r['name'], r['price'], r['stock']) for r in rows],
+                         [('Replaced', 9.5, 3), ('New A', 1.25, None), ('New C', 3.0, 7)])
+        self.assertEqual(self.client.get('/products/1').headers['ETag'], '"1-2"')
+
+        csv_lines = self.client.get('/products/export?format=csv', headers=headers).get_data(as_text=True).splitlines()
+        self.assertEqual(csv_lines[0], 'id,name,description,price,image_url,stock')
+        self.assertEqual(len(csv_lines), 4)
+
+    def test_import_rejects_mistyped_fields(self):
+        """Test that JSON Lines rows with wrongly typed fields are reported, not imported."""
+        headers = self._create_admin()
+        rows = [{'name': 5, 'price': 1}, {'name': 'A', 'price': 1, 'image_url': 7},
+                {'name': 'B', 'price': 1, 'description': ['x']}, {'name': 'C', 'price': 1, 'stock': 1.7},
+                {'name': 'D', 'price': 1, 'stock': True}, {'name': 'E', 'price': 1, 'stock': 2.0},
+                {'name': 'F', 'price': 1, 'stock': '4'}]
+        response = self.client.post('/products/import?format=jsonl',
+                                    data=''.join(json.dumps(row) + '\n' for row in rows),
+                                    content_type='application/x-ndjson', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual((report['imported'], report['failed']), (2, 5))
+        self.assertEqual([e['error'] for e in report['errors']],
+                         ['name must be a string', 'image_url must be a string', 'description must be a string',
+                          'Invalid stock', 'Invalid stock'])
+        with app.app_context():
+            self.assertEqual([(p.name, p.stock) for p in Product.query.order_by(Product.id)], [('E', 2), ('F', 4)])
+
+    def test_import_export_cli(self):
+        """Test the import-products and export-products commands."""
+        runner = app.test_cli_runner()
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'feed.jsonl')
+            with open(source, 'w') as f:
+                f.write('{"name": "Lamp", "price": 12}\n{"name": "Desk"}\nnot json\n')
+            result = runner.invoke(args=['import-products', source])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('"imported": 1', result.output)
+            self.assertIn('line 3: Invalid JSON', result.output)
+
+            target = os.path.join(tmp, 'out.csv')
+            result = runner.invoke(args=['export-products', target])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(target) as f:
+                self.assertEqual(f.read().splitlines()[1], '1,Lamp,,12.0,,')
+
+    def test_streamed_collections(self):
+        """Test NDJSON and chunked JSON streaming of products and orders."""
+        self._create_products(3)
+        response = self.client.get('/products?min_price=1', headers={'Accept': 'application/x-ndjson'})
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Product 1', 'Product 2'])
+
+        data = self.client.get('/products?stream=json&fields=name').get_json()
+        self.assertEqual(data, {'products': [{'id': 1, 'name': 'Product 0'}, {'id': 2, 'name': 'Product 1'},
+                                             {'id': 3, 'name': 'Product 2'}], 'next_cursor': None})
+
+        user_id = self._create_user_with_history(orders=3, items_per_order=2)
+        headers = self._auth_headers(user_id)
+        expected = self.client.get('/orders', headers=headers).get_json()
+        response = self.client.get('/orders?stream=json', headers=headers)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_json(), expected)
+        lines = self.client.get('/orders?stream=ndjson', headers=headers).get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected['orders'])
+
+    def test_full_text_search(self):
+        """Test prefix matching, ranking, highlighting and index maintenance."""
+        headers = self._create_admin()
+        with app.app_context():
+            db.session.add_all([
+                Product(name='Wooden desk lamp', description='Warm light', price=30.0),
+                Product(name='Standing desk', description='Adjustable height', price=300.0),
+                Product(name='Office chair', description='Pairs well with a desk', price=120.0),
+            ])
+            db.session.commit()
+
+        data = self.client.get('/products/search?q=des').get_json()
+        # Name matches outrank the description-only match
+        self.assertEqual([p['id'] for p in data['products']][-1], 3)
+        self.assertEqual(len(data['products']), 3)
+        self.assertIn('<mark>desk</mark>', data['products'][0]['name_highlight'])
+
+        data = self.client.get('/products/search?q=desk&limit=2').get_json()
+        self.assertEqual(len(data['products']), 2)
+        self.assertEqual(data['next_offset'], 2)
+
+        self.client.put('/products/2', data=json.dumps({'name': 'Standing table'}),
+                        content_type='application/json', headers=headers)
+        self.client.delete('/products/1', headers=headers)
+        data = self.client.get('/products/search?q=desk').get_json()
+        self.assertEqual([p['id'] for p in data['products']], [3])
+        self.assertEqual(self.client.get('/products/search?q=tabl').get_json()['products'][0]['id'], 2)
+
+        self.assertEqual(self.client.get('/products/search?q=" OR *').get_json()['products'], [])
+
+        # Product text is escaped around the highlights
+        with app.app_context():
+            db.session.add(Product(name='<img src=x onerror=alert(1)> lamp', description='a & b lamp', price=1.0))
+            db.session.commit()
+        found = self.client.get('/products/search?q=lamp').get_json()['products'][0]
+        self.assertEqual(found['name_highlight'], '&lt;img src=x onerror=alert(1)&gt; <mark>lamp</mark>')
+        self.assertEqual(found['description_snippet'], 'a &amp; b <mark>lamp</mark>')
+
+        # Every match is ranked: the best one is found however many older ones precede it
+        with app.app_context():
+            db.session.add_all([Product(name=f'Item {i}', description='lamp ' + 'filler ' * 20, price=1.0)
+                                for i in range(30)])
+            db.session.add(Product(name='lamp lamp', description='', price=1.0))
+            db.session.commit()
+            best = db.session.query(func.max(Product.id)).scalar()
+        self.assertEqual(self.client.get('/products/search?q=lamp').get_json()['products'][0]['id'], best)
+        self.assertEqual(self.client.get('/products/search').status_code, 400)
+
+    def test_login_token_authenticates_without_user_lookups(self):
+        """Test that /login issues a token that protected endpoints accept."""
+        self.client.post('/register', data=json.dumps(
+            {'username': 'bob', 'email': 'bob@example.com', 'password': 'secret'}),
+            content_type='application/json')
+        token = self.client.post('/login', data=json.dumps(
+            {'email': 'bob@example.com', 'password': 'secret'}),
+            content_type='application/json').get_json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        # The cart query is the only statement; identity comes from the token
+        with self.assertQueryBudget(1):
+            self.assertEqual(self.client.get('/cart', headers=headers).status_code, 200)
+
+        self.assertEqual(self.client.get('/profile', headers=headers).get_json()['username'], 'bob')
+        with self.assertQueryBudget(0):
+            self.assertEqual(self.client.get('/profile', headers=headers).get_json()['email'], 'bob@example.com')
+
+        forged = {'Authorization': f'Bearer {token[:-2]}xx'}
+        response = self.client.get('/cart', headers=forged)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Token is invalid or expired!', response.get_data(as_text=True))
+        self.assertEqual(self.client.get('/cart', headers={'x-user-id': '1'}).status_code, 401)
+
+    def test_rate_limits(self):
+        """Test per-route limits per client, 429 with Retry-After, and the shared store."""
+        limiter = app.extensions['rate_limiter']
+        credentials = json.dumps({'email': 'nobody@example.com', 'password': 'wrong'})
+
+        def login(addr='10.0.0.1', headers=None):
+            return self.client.post('/login', data=credentials, content_type='application/json',
+                                    headers=headers, environ_base={'REMOTE_ADDR': addr})
+
+        with mock.patch.dict(app.config, {'RATELIMIT_ENABLED': True}), \
+                mock.patch.object(limiter, 'store', TokenBuckets()), \
+                mock.patch.dict(limiter.limits, {'api.login': Limit(2, 60)}):
+            self.assertEqual([login().status_code for _ in range(2)], [401, 401])
+            response = login()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.get_json(), {'message': 'Too many requests'})
+            self.assertEqual(response.headers['Retry-After'], '30')
+            # Rejected requests are still identified and logged
+            self.assertEqual(login(headers={'X-Request-ID': 'limited'}).headers['X-Request-ID'], 'limited')
+            log_writer.stop()  # Drains the queue
+            try:
+                with open(log_writer.path()) as f:
+                    logged = [json.loads(line) for line in f]
+            finally:
+                log_writer.start()
+            self.assertEqual(next(e for e in logged if e.get('request_id') == 'limited')['status'], 429)
+
+            # Other clients, other routes and unlimited routes are unaffected
+            self.assertEqual(login('10.0.0.2').status_code, 401)
+            token = self._create_admin()
+            self.assertEqual(login(headers=token).status_code, 401)
+            self.assertEqual(self.client.get('/products', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+            # Behind a trusted proxy, clients are told apart by X-Forwarded-For
+            with mock.patch.object(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1, x_proto=1)):
+                for client in ('203.0.113.1', '203.0.113.2'):
+                    forwarded = {'X-Forwarded-For': client}
+                    self.assertEqual([login('10.0.0.9', forwarded).status_code for _ in range(3)],
+                                     [401, 401, 429])
+
+        self.assertEqual(login().status_code, 401)
+
+        # Tokens refill continuously
+        buckets = TokenBuckets(max_keys=4)
+        limit = Limit.parse('2/second')
+        self.assertEqual([buckets.take('a', limit, now) for now in (0, 0)], [0, 0])
+        self.assertAlmostEqual(buckets.take('a', limit, 0.25), 0.25)
+        self.assertEqual(buckets.take('a', limit, 0.5), 0)
+        for key in 'bcde':
+            buckets.take(key, limit, 10)
+        self.assertLessEqual(len(buckets), 4)
+        with self.assertRaises(ValueError):
+            Limit.parse('10 per minute')
+
+        # The sliding window weighs in the previous window's count
+        windows = SlidingWindows(LocalKV())
+        limit = Limit.parse('4/minute')
+        self.assertEqual([windows.take('a', limit, 60 + t) for t in (1, 2, 3, 4)], [0, 0, 0, 0])
+        self.assertAlmostEqual(windows.take('a', limit, 65), 55)
+        self.assertAlmostEqual(windows.take('a', limit, 135), 9)
+        self.assertEqual(windows.take('a', limit, 170), 0)
+
+        overhead = rate_limit_overhead.measure(app, iterations=2000, repeat=3, clients=100)
+        self.assertLess(overhead['check_anonymous'] - overhead['check_disabled'], RATE_LIMIT_BUDGET_US)
+
+    def test_add_to_cart_creates_cart(self):
+        """Test that the first add creates the cart and later adds accumulate."""
+        headers = self._create_admin()
+        self._create_products(1)
+        for _ in range(2):
+            response = self.client.post('/cart/add', data=json.dumps({'product_id': 1, 'quantity': 2}),
+                                        content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/cart', headers=headers).get_json()['items'][0]['quantity'], 4)
+
+    def test_kv_cart_store_with_write_behind(self):
+        """Test key-value carts: SQL-free mutations, flush to SQL and checkout."""
+        headers = self._create_admin()
+        self._create_products(3)
+        store = KVCartStore(LocalKV())
+
+        def cart_rows():
+            with app.app_context():
+                return sorted((i.product_id, i.quantity) for i in CartItem.query.all())
+
+        with mock.patch('app.routes.cart_store', store):
+            def send(method, url, body=None):
+                return self.client.open(url, method=method, headers=headers, content_type='application/json',
+                                        data=json.dumps(body) if body is not None else None)
+
+            send('POST', '/cart/add', {'product_id': 1, 'quantity': 1})
+            # Only the product existence checks touch the database
+            with self.assertQueryBudget(2):
+                send('POST', '/cart/add', {'product_id': 1, 'quantity': 2})
+                send('POST', '/cart/add', {'product_id': 2, 'quantity': 1})
+            with self.assertQueryBudget(0):
+                self.assertEqual(send('PUT', '/cart/update/2', {'quantity': 5}).status_code, 200)
+                self.assertEqual(send('DELETE', '/cart/remove/3').status_code, 404)
+            self.assertEqual(cart_rows(), [])
+
+            cart = send('GET', '/cart').get_json()
+            self.assertEqual([(i['product_id'], i['quantity']) for i in cart['items']], [(1, 3), (2, 5)])
+
+            with app.app_context():
+                store.flush()
+            self.assertEqual(cart_rows(), [(1, 3), (2, 5)])
+
+            send('DELETE', '/cart/remove/2')
+            response = send('POST', '/orders/create')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(send('GET', '/cart').get_json()['items'], [])
+            with app.app_context():
+                store.flush()
+            self.assertEqual(cart_rows(), [])
+
+        order = self.client.get('/orders', headers=headers).get_json()['orders'][0]
+        self.assertEqual([(i['product_id'], i['quantity']) for i in order['items']], [(1, 3)])
+
+    def test_kv_cart_store_changes_are_atomic(self):
+        """Test that concurrent PATCH batches and adds never overwrite each other."""
+
+        class SlowKV(LocalKV):
+            def hgetall(self, key):
+                fields = super().hgetall(key)
+                time.sleep(0.001)  # Widen the gap between reading and rewriting a cart
+                return fields
+
+        store = KVCartStore(SlowKV())
+        with app.app_context():
+            store.items(1)  # Seed from SQL once; the threads below touch only the store
+
+        def change(index):
+            if index % 2:
+                store.apply(1, [('add', 7, 1)])
+            else:
+                store.add(1, 7, 1)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(change, range(100)))
+        self.assertEqual(store.kv.hgetall('cart:1')['7'], 100)
+
+        # A first touch never overwrites changes made since it checked the cart
+        kv = LocalKV()
+        store = KVCartStore(kv)
+        real_hexists = kv.hexists
+
+        def hexists(key, field):
+            found = real_hexists(key, field)
+            if not found and not kv._hashes:
+                kv.hset(key, mapping={KVCartStore.LOADED: 1, '7': 5})  # Another request got there first
+            return found
+
+        # The SQL copy is older than the one another request already seeded
+        with mock.patch.object(kv, 'hexists', hexists), \
+                mock.patch('app.carts.SQLCartStore.items', return_value=[(1, 7, 2)]):
+            self.assertEqual(store.items(1), [(7, 7, 5)])
+
+    def test_patch_cart_batch_operations(self):
+        """Test that PATCH /cart applies a batch of operations in one transaction."""
+        self._create_products(4)
+        operations = [
+            {'op': 'add', 'product_id': 1, 'quantity': 2},
+            {'op': 'set', 'product_id': 2, 'quantity': 4},
+            {'op': 'add', 'product_id': 3, 'quantity': 1},
+            {'op': 'remove', 'product_id': 3},
+            {'op': 'set', 'product_id': 4, 'quantity': 0},
+        ]
+
+        for user_id, store in ((101, None), (102, KVCartStore(LocalKV()))):
+            headers = self._auth_headers(user_id)
+            with mock.patch('app.routes.cart_store', store) if store else nullcontext():
+                self.client.post('/cart/add', data=json.dumps({'product_id': 1, 'quantity': 1}),
+                                 content_type='application/json', headers=headers)
+                with self.assertQueryBudget(7):
+                    response = self.client.patch('/cart', data=json.dumps({'operations': operations}),
+                                                 content_type='application/json', headers=headers)
+                self.assertEqual(response.status_code, 200)
+                data = response.get_json()
+                self.assertEqual([(i['product_id'], i['quantity']) for i in data['items']], [(1, 3), (2, 4)])
+                self.assertEqual(data['total'], 3 * 0.0 + 4 * 1.0)
+
+                # Removing and re-adding a product in one batch keeps a single row for it
+                response = self.client.patch('/cart', data=json.dumps({'operations': [
+                    {'op': 'remove', 'product_id': 1}, {'op': 'add', 'product_id': 1, 'quantity': 5}]}),
+                    content_type='application/json', headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([(i['product_id'], i['quantity']) for i in response.get_json()['items']],
+                                 [(1, 5), (2, 4)])
+
+        # An unknown product rejects the whole batch
+        headers = self._auth_headers(101)
+        response = self.client.patch('/cart', data=json.dumps({'operations': [
+            {'op': 'remove', 'product_id': 1}, {'op': 'add', 'product_id': 99, 'quantity': 1}]}),
+            content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['product_ids'], [99])
+        self.assertEqual(len(self.client.get('/cart', headers=headers).get_json()['items']), 2)
+
+        for bad in ({'op': 'set', 'product_id': 1}, {'op': 'add', 'product_id': True, 'quantity': 1},
+                    {'op': 'add', 'product_id': 10 ** 20, 'quantity': 1},
+                    {'op': 'add', 'product_id': 1, 'quantity': 10 ** 20},
+                    {'op': 'set', 'product_id': 1, 'quantity': False}):
+            response = self.client.patch('/cart', data=json.dumps({'operations': [bad]}),
+                                         content_type='application/json', headers=headers)
+            self.assertEqual(response.get_json(), {'message': 'Invalid operation', 'index': 0})
+
+    def _metric_samples(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.mimetype, 'text/plain')
+        samples = {}
+        for line in response.get_data(as_text=True).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_metrics_endpoint(self):
+        """Test per-route latency, SQL and size metrics in Prometheus format."""
+        self._create_products(2)
+        route = 'route="/products/<int:product_id>"'
+        count = f'http_request_duration_seconds_count{{method="GET",{route},status="200"}}'
+        queries = f'db_queries_per_request_sum{{{route}}}'
+        size = f'http_response_size_bytes_sum{{method="GET",{route}}}'
+
+        before = self._metric_samples()
+        self.client.get('/products/1')
+        self.client.get('/products/1')
+        after = self._metric_samples()
+
+        self.assertEqual(after[count] - before.get(count, 0), 2)
+        self.assertEqual(after[queries] - before.get(queries, 0), 1)  # Second read was cached
+        self.assertGreater(after[size] - before.get(size, 0), 0)
+        self.assertEqual(after['http_requests_in_flight'], 1)  # This request
+        self.assertEqual(after['product_cache_hits_total'] - before['product_cache_hits_total'], 1)
+
+    def test_slow_request_log(self):
+        """Test that slow requests log their SQL statements."""
+        self._create_products(1)
+        app.config['SLOW_REQUEST_THRESHOLD_MS'] = 0.000001
+        try:
+            with self.assertLogs(app.logger, level='WARNING') as logs:
+                self.client.get('/products/1')
+        finally:
+            app.config['SLOW_REQUEST_THRESHOLD_MS'] = 0
+        self.assertIn('Slow request GET /products/1', logs.output[0])
+        self.assertIn('FROM product', logs.output[0])
+
+    def test_request_log(self):
+        """Test that requests carry an ID and are logged as JSON lines off-thread."""
+        self._create_products(1)
+        response = self.client.get('/products/1', headers={'X-Request-ID': 'abc123'})
+        self.assertEqual(response.headers['X-Request-ID'], 'abc123')
+        generated = self.client.get('/products/1').headers['X-Request-ID']
+        self.assertEqual(len(generated), 32)
+
+        log_writer.stop()  # Drains the queue
+        try:
+            with open(log_writer.path()) as f:
+                entries = [json.loads(line) for line in f]
+        finally:
+            log_writer.start()
+        entry = next(e for e in entries if e.get('request_id') == 'abc123')
+        self.assertEqual(entry['path'], '/products/1')
+        self.assertEqual(entry['status'], 200)
+        self.assertIn('duration_ms', entry)
+        self.assertTrue(any(e.get('request_id') == generated for e in entries))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_log_files_are_reused_across_worker_restarts(self):
+        """Test that each live process has its own log file and replacements reuse them."""
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = LogWriter(tmp, 1024 * 1024, 1, 'INFO')
+            writer.start()
+
+            def log(message):
+                writer.handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO,
+                                                             'levelname': 'INFO'}))
+
+            def worker(message):
+                pid = os.fork()
+                if pid == 0:
+                    # The fork hook has moved the writer to a slot of its own
+                    log(message)
+                    writer.stop()
+                    os._exit(0)
+                os.waitpid(pid, 0)
+
+            try:
+                log('master')
+                worker('first')
+                worker('restarted')
+            finally:
+                writer.stop()
+            self.assertEqual(writer.path(), os.path.join(tmp, 'ecommerce.0.log'))
+            self.assertEqual(sorted(f for f in os.listdir(tmp) if f.endswith('.log')),
+                             ['ecommerce.0.log', 'ecommerce.1.log'])
+            with open(os.path.join(tmp, 'ecommerce.1.log')) as f:
+                self.assertEqual([json.loads(line)['message'] for line in f], ['first', 'restarted'])
 
 if __name__ == '__main__':
     unittest.main()
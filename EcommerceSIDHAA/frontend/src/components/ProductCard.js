@@ -5,7 +5,14 @@ const ProductCard = ({ product }) => {
   return (
     <div className="card">
       <Link to={`/product/${product.id}`}>
-        <img src={product.image_url} alt={product.name} className="card-img" />
+        {product.images ? (
+          <picture>
+            <source srcSet={product.images.thumb_webp} type="image/webp" />
+            <img src={product.images.thumb} alt={product.name} className="card-img" loading="lazy" />
+          </picture>
+        ) : (
+          <img src={product.image_url} alt={product.name} className="card-img" loading="lazy" />
+        )}
       </Link>
       <div className="card-body">
         <Link to={`/product/${product.id}`}>
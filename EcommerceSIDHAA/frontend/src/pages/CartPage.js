@@ -20,7 +20,7 @@ const CartPage = () => {
       setLoading(true);
       const config = {
         headers: {
-          'x-user-id': user.userId,
+          Authorization: `Bearer ${user.token}`,
         },
       };
       const { data } = await axios.get('http://127.0.0.1:5000/cart', config);
@@ -41,7 +41,7 @@ const CartPage = () => {
       const config = {
         headers: {
           'Content-Type': 'application/json',
-          'x-user-id': user.userId,
+          Authorization: `Bearer ${user.token}`,
         },
       };
       await axios.put(
@@ -59,7 +59,7 @@ const CartPage = () => {
     try {
       const config = {
         headers: {
-          'x-user-id': user.userId,
+          Authorization: `Bearer ${user.token}`,
         },
       };
       await axios.delete(`http://127.0.0.1:5000/cart/remove/${productId}`, config);
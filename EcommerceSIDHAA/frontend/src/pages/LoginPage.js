@@ -19,7 +19,7 @@ const LoginPage = () => {
         email,
         password,
       });
-      login({ userId: data.user_id });
+      login({ userId: data.user_id, token: data.token });
       navigate('/');
     } catch (err) {
       setError(err.response?.data?.message || 'Login failed');
@@ -38,7 +38,7 @@ const ProductDetailPage = () => {
       const config = {
         headers: {
           'Content-Type': 'application/json',
-          'x-user-id': user.userId,
+          Authorization: `Bearer ${user.token}`,
         },
       };
 
@@ -64,7 +64,14 @@ const ProductDetailPage = () => {
       ) : product ? (
         <div>
           <h1>{product.name}</h1>
-          <img src={product.image_url} alt={product.name} style={{ maxWidth: '400px' }} />
+          {product.images ? (
+            <picture>
+              <source srcSet={product.images.medium_webp} type="image/webp" />
+              <img src={product.images.medium} alt={product.name} style={{ maxWidth: '400px' }} />
+            </picture>
+          ) : (
+            <img src={product.image_url} alt={product.name} style={{ maxWidth: '400px' }} />
+          )}
           <p>{product.description}</p>
           <h2>${product.price}</h2>
 